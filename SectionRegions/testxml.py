@@ -1,22 +1,213 @@
-import timeit
+#!/usr/bin/env python
+"""
+Benchmark the section recorder readers in xmlutils.
 
-from xmlutils import read_sect_xml3, read_sect_xml2, read_sect_xml1, read_sect_xml0
+    python testxml.py [options] [eleDef.txt...]
 
+Options
+-e <int>        number of elements in the synthetic recorder (default 30)
+-s <int>        sections per element (default 1)
+-n <int>        number of time steps (default 12600)
+-r <int>        repetitions per reader (default 3)
+-k <name>,...   readers to run (default all)
+-o <file>       file to append results to (default xml_bench.jsonl)
 
-a = read_sect_xml0("GM1/eleDef1.txt")
+When no files are given, a synthetic eleDef recorder of the requested
+size is generated in a temporary directory. Each reader runs in a fresh
+process so that its peak RSS can be measured, and the output of every
+reader is checked against read_sect_xml3 (read_sect_xml0-2 only see the
+first section of each element, so they are expected to differ when
+-s > 1). One JSON record per run is appended to the output file.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import platform
+import subprocess
+import multiprocessing
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
-b = read_sect_xml3("GM1/eleDef1.txt")
+import numpy as np
 
-for k,v in a.items():
-    for kk, vv in v.items():
-        for kkk, vvv in vv.items():
-            assert not any(vvv - b[k][kk][kkk]), (k, kk, kkk)
+import xmlutils
 
-n = 100
-for i in reversed(range(4)):
+RESPONSES = ("eps", "kappaZ", "kappaY", "theta", "gammaY", "gammaZ")
 
-    print(i, 
-       timeit.timeit(f"read_sect_xml{i}('GM1/eleDef1.txt')", 
-           number=n, globals=globals()))
+READERS = {
+    "xml0":        (xmlutils.read_sect_xml0, {}),
+    "xml1":        (xmlutils.read_sect_xml1, {}),
+    "xml2":        (xmlutils.read_sect_xml2, {}),
+    "xml3":        (xmlutils.read_sect_xml3, {}),
+    "xml4":        (xmlutils.read_sect_xml4, {"cache": False}),
+    "xml4-cached": (xmlutils.read_sect_xml4, {"cache": True}),
+}
 
+def write_recorder(filename, nelem=30, nsec=1, nsteps=12600, seed=0):
+    "Write a synthetic eleDef recorder in the format of OpenSees' -xml output."
+    rng = np.random.default_rng(seed)
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n <OpenSees>\n')
+        for e in range(nelem):
+            tag = 1000 + 10*e
+            f.write(f'    <ElementOutput eleType="ForceBeamColumn3d" eleTag="{tag}" node1="1" node2="2">\n')
+            for s in range(nsec):
+                f.write(f'        <GaussPointOutput number="{s+1}" eta="0">\n')
+                f.write(f'            <SectionOutput secType="SectionAggregator" secTag="{tag}">\n')
+                for r in RESPONSES:
+                    f.write(f'                <ResponseType>{r}</ResponseType>\n')
+                f.write('            </SectionOutput>\n        </GaussPointOutput>\n')
+            f.write('    </ElementOutput>\n')
+
+        f.write('    <Data>\n')
+        ncols = nelem*nsec*len(RESPONSES)
+        row = "        " + "%g "*ncols + "\n"
+        for i in range(0, nsteps, 1000):
+            block = rng.standard_normal((min(1000, nsteps - i), ncols))*1e-4
+            f.writelines(row % tuple(r) for r in block)
+        f.write('        </Data>\n</OpenSees>\n')
+
+
+def _run(name, filename, repeat):
+    "Time one reader in the current (fresh) process."
+    read, kwds = READERS[name]
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if kwds.get("cache", False):
+        read(filename, **kwds)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = read(filename, **kwds)
+        times.append(time.perf_counter() - start)
+        del data
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"times": times, "peak_rss_kb": rss, "base_rss_kb": rss0}
+
+
+def _flatten(data, prefix=()):
+    for key, item in data.items():
+        if isinstance(item, Mapping):
+            yield from _flatten(item, prefix + (key,))
+        else:
+            yield prefix + (key,), item
+
+def check_readers(names, filename)->dict:
+    "Compare the output of each reader to that of read_sect_xml3."
+    reference = dict(_flatten(xmlutils.read_sect_xml3(filename)))
+    result = {}
+    for name in names:
+        read, kwds = READERS[name]
+        output = dict(_flatten(read(filename, **kwds)))
+        result[name] = output.keys() == reference.keys() and all(
+            np.array_equal(output[k], reference[k]) for k in reference
+        )
+    xmlutils.clean_cache(filename)
+    return result
+
+
+def benchmark(filename, names=tuple(READERS), repeat=3)->dict:
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f, \
+         xmlutils.mmap.mmap(f.fileno(), 0, access=xmlutils.mmap.ACCESS_READ) as mm:
+        _, start, end = xmlutils._data_range(mm)
+        nrows = xmlutils._count_rows(mm, start, end)
+
+    spawn = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            result = pool.submit(_run, name, filename, repeat).result()
+        best = min(result["times"])
+        result.update({
+            "best_s": best,
+            "mb_per_s":   size/1e6/best,
+            "rows_per_s": nrows/best,
+        })
+        results[name] = result
+        print(f"{name:12} {best:8.4f} s  {size/1e6/best:8.1f} MB/s  "
+              f"{nrows/best:10.0f} rows/s  {result['peak_rss_kb']/1024:8.1f} MiB",
+              file=sys.stderr)
+
+    xmlutils.clean_cache(filename)
+    matches = check_readers(names, filename)
+    for name in names:
+        results[name]["matches_xml3"] = matches[name]
+        if not matches[name]:
+            print(f"{name} does not match read_sect_xml3", file=sys.stderr)
+
+    return {"file": str(filename), "bytes": size, "rows": nrows, "readers": results}
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_args(args)->dict:
+    opts = {
+        "nelem": 30,
+        "nsec": 1,
+        "nsteps": 12600,
+        "repeat": 3,
+        "readers": list(READERS),
+        "output": "xml_bench.jsonl",
+        "files": []
+    }
+    argi = iter(args)
+    for arg in argi:
+        if arg in ["--help", "-h"]:
+            print(__doc__)
+            sys.exit()
+        elif arg == "-e":
+            opts["nelem"] = int(next(argi))
+        elif arg == "-s":
+            opts["nsec"] = int(next(argi))
+        elif arg == "-n":
+            opts["nsteps"] = int(next(argi))
+        elif arg == "-r":
+            opts["repeat"] = int(next(argi))
+        elif arg == "-k":
+            opts["readers"] = next(argi).split(",")
+        elif arg == "-o":
+            opts["output"] = next(argi)
+        else:
+            opts["files"].append(arg)
+    return opts
+
+
+if __name__ == "__main__":
+    opts = parse_args(sys.argv[1:])
+
+    record = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "repeat": opts["repeat"],
+        "runs": []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = opts["files"]
+        if not files:
+            files = [os.path.join(tmp, "eleDef1.txt")]
+            write_recorder(files[0], opts["nelem"], opts["nsec"], opts["nsteps"])
+            record["synthetic"] = {k: opts[k] for k in ("nelem", "nsec", "nsteps")}
+
+        for file in files:
+            record["runs"].append(benchmark(file, opts["readers"], opts["repeat"]))
+
+    with open(opts["output"], "a") as f:
+        f.write(json.dumps(record) + "\n")
 
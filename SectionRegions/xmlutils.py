@@ -1,6 +1,17 @@
+import os
 import re
+import sys
+import json
+import gzip
+import lzma
+import shutil
+import time
+import mmap
+import hashlib
+from pathlib import Path
 import numpy as np
 from collections import defaultdict
+from collections.abc import Mapping
 import xml.etree.ElementTree as ET
 
 re_elem_tag = re.compile(rb'eleTag="([0-9]*)"')
@@ -53,6 +64,851 @@ def read_sect_xml3(filename: str)->dict:
     getDictData(data.reshape((-1, counter)), data_dict)
     return data_dict
 
+# Size in bytes of the pieces of <Data> that are handed to the float parser
+# at once by read_sect_xml4.
+CHUNK_SIZE = 1 << 22
+
+def _read_header(lines)->list:
+    """
+    Return a list with one (element, section, response) key for each column
+    of the recorder, in column order. A time column is keyed ("time",).
+    """
+    keys = []
+    seen = set()
+    elem_tag = sect = None
+    for line in lines:
+        if b"<TimeOutput" in line:
+            keys.append(("time",))
+
+        elif b"<ElementOutput" in line and (elem := re_elem_tag.search(line)):
+            elem_tag = elem.group(1).decode()
+
+        elif b"<GaussPointOutput" in line:
+            sect = re_sect_num.search(line).group(1).decode()
+
+        elif b"<ResponseType" in line and elem_tag is not None:
+            r_label = resp_tag.search(line).group(1).decode()
+            while (elem_tag, sect, r_label) in seen:
+                r_label += "_"
+            seen.add((elem_tag, sect, r_label))
+            keys.append((elem_tag, sect, r_label))
+
+        elif b"</ElementOutput>" in line:
+            elem_tag = None
+
+    return keys
+
+class ResponseTable(Mapping):
+    """
+    Section recorder output held as one contiguous (nsteps, ncols) array
+    with integer maps from element, section and response labels to columns.
+
+    The table can be indexed like the nested dicts of read_sect_xml3, e.g.
+    ``table["4010"]["1"]["eps"]``, but lookups in tight loops should go
+    through column()/columns() and index `data` directly.
+    """
+    __slots__ = ("data", "keys", "elements", "sections", "responses", "time",
+                 "_index", "_regular")
+
+    def __init__(self, keys, data):
+        self.data = data
+        self.keys = list(keys)
+        self.time = None
+        self.elements, self.sections, self.responses = {}, {}, {}
+        located = []
+        for i, key in enumerate(self.keys):
+            if len(key) == 1:
+                self.time = i
+                continue
+            located.append((i, *(
+                labels.setdefault(label, len(labels))
+                for labels, label in zip((self.elements, self.sections, self.responses), key)
+            )))
+        self._index = np.full((len(self.elements), len(self.sections), len(self.responses)),
+                              -1, dtype=np.intp)
+        for i, e, s, r in located:
+            self._index[e, s, r] = i
+
+        # Every element has the same sections and responses, in recorder
+        # order, after an optional leading time column.
+        offset = int(self.time is not None)
+        self._regular = (self.time in (None, 0)
+                         and np.array_equal(self._index.ravel(),
+                                            np.arange(self._index.size) + offset)
+                         and data.shape[1] == self._index.size + offset)
+
+    @property
+    def nsteps(self)->int:
+        return len(self.data)
+
+    def column(self, ele, sec, resp)->int:
+        "Column of response `resp` at section `sec` of element `ele`."
+        try:
+            col = self._index[self.elements[str(ele)], self.sections[str(sec)], self.responses[resp]]
+        except KeyError:
+            col = -1
+        if col < 0:
+            raise KeyError((ele, sec, resp))
+        return int(col)
+
+    def columns(self, ele, sec, responses)->np.ndarray:
+        return np.array([self.column(ele, sec, r) for r in responses], dtype=np.intp)
+
+    def block(self, elements=None, sections=None, responses=None)->np.ndarray:
+        """
+        Return the responses of the given elements and sections as an array
+        of shape (nsteps, nelem, nsect, nresp). Each selector is None (all),
+        a single label or a list of labels; None means all of the labels
+        recorded for the rest of the selection, in table order. Responses
+        that were not recorded for some of the selected elements or sections
+        are NaN. When the table holds complete recorder output and no
+        selector is a list, the result is a view of `data`; otherwise the
+        columns are gathered into a new array.
+        """
+        select = [
+            slice(None) if chosen is None else
+            labels[str(chosen)] if isinstance(chosen, (str, int)) else
+            [labels[str(c)] for c in chosen]
+            for labels, chosen in zip((self.elements, self.sections, self.responses),
+                                      (elements, sections, responses))
+        ]
+
+        if self._regular and not any(isinstance(sel, list) for sel in select):
+            offset = int(self.time is not None)
+            cube = self.data[:, offset:].reshape((self.nsteps, *self._index.shape))
+            return cube[(slice(None), *(
+                slice(sel, sel+1) if isinstance(sel, int) else sel for sel in select
+            ))]
+
+        cols = self._index[np.ix_(*(
+            [sel] if isinstance(sel, int) else np.arange(n)[sel]
+            for sel, n in zip(select, self._index.shape)
+        ))]
+        for axis, chosen in enumerate((elements, sections, responses)):
+            if chosen is None:
+                recorded = (cols >= 0).any(axis=tuple(a for a in range(3) if a != axis))
+                cols = np.compress(recorded, cols, axis=axis)
+        block = self.data[:, np.maximum(cols, 0)]
+        if (cols < 0).any():
+            block[:, cols < 0] = np.nan
+        return block
+
+    # Mapping interface, for code written against the nested dicts
+    def __getitem__(self, ele):
+        if ele == "time" and self.time is not None:
+            return self.data[:, self.time]
+        if str(ele) not in self.elements:
+            raise KeyError(ele)
+        return _ElementView(self, self.elements[str(ele)])
+
+    def __iter__(self):
+        if self.time is not None:
+            yield "time"
+        yield from self.elements
+
+    def __len__(self):
+        return len(self.elements) + (self.time is not None)
+
+class _ElementView(Mapping):
+    __slots__ = ("table", "ele")
+    def __init__(self, table, ele):
+        self.table, self.ele = table, ele
+
+    def _sections(self):
+        present = (self.table._index[self.ele] >= 0).any(axis=1)
+        return [s for s, i in self.table.sections.items() if present[i]]
+
+    def __getitem__(self, sec):
+        i = self.table.sections.get(str(sec))
+        if i is None or not (self.table._index[self.ele, i] >= 0).any():
+            raise KeyError(sec)
+        return _SectionView(self.table, self.table._index[self.ele, i])
+
+    def __iter__(self):
+        return iter(self._sections())
+
+    def __len__(self):
+        return len(self._sections())
+
+class _SectionView(Mapping):
+    __slots__ = ("table", "cols")
+    def __init__(self, table, cols):
+        self.table, self.cols = table, cols
+
+    def __getitem__(self, resp):
+        i = self.table.responses.get(resp)
+        if i is None or self.cols[i] < 0:
+            raise KeyError(resp)
+        return self.table.data[:, self.cols[i]]
+
+    def __iter__(self):
+        return (r for r, i in self.table.responses.items() if self.cols[i] >= 0)
+
+    def __len__(self):
+        return int((self.cols >= 0).sum())
+
+def _iter_blocks(buf, start, end, size=CHUNK_SIZE):
+    """
+    Yield copies of buf[start:end] in pieces of roughly `size` bytes, each
+    cut after a newline so that no row is split between two pieces.
+    """
+    while start < end:
+        stop = min(start + size, end)
+        if stop < end:
+            stop = buf.rfind(b"\n", start, stop) + 1 or buf.find(b"\n", stop, end) + 1 or end
+        yield buf[start:stop]
+        start = stop
+
+def _count_rows(buf, start, end, size=CHUNK_SIZE)->int:
+    return sum(block.count(b"\n") for block in _iter_blocks(buf, start, end, size))
+
+# Column keys of recently parsed headers, by (header length, header hash).
+# Recorders of every ground motion in a suite share the same header, so it
+# only has to be parsed once per process.
+_SCHEMAS = {}
+MAX_SCHEMAS = 32
+
+def _read_schema(buf)->tuple:
+    """
+    Return the offset of the <Data> tag in buf and the column keys of the
+    header before it. Headers that were parsed before are recognized by a
+    hash of their bytes and are not parsed again.
+    """
+    for tag in {tag: None for tag, _ in reversed(_SCHEMAS)}:
+        if buf[tag:tag+6] == b"<Data>":
+            key = tag, hashlib.blake2b(buf[:tag]).digest()
+            if key in _SCHEMAS:
+                return tag, _SCHEMAS[key]
+
+    tag = buf.find(b"<Data>")
+    if tag < 0:
+        raise ValueError("No <Data> block found in recorder file")
+    header = buf[:tag]
+    keys = tuple(_read_header(header.splitlines()))
+    if len(_SCHEMAS) >= MAX_SCHEMAS:
+        _SCHEMAS.pop(next(iter(_SCHEMAS)))
+    _SCHEMAS[tag, hashlib.blake2b(header).digest()] = keys
+    return tag, keys
+
+def _data_range(buf, tag=None, partial=False)->tuple:
+    """
+    Return the byte offsets of the <Data> tag and of the first and one past
+    the last row inside it. Every row in the range ends with a newline.
+    A recorder without the closing </Data> tag is an error, unless
+    `partial` is set for one that is still being written.
+    """
+    if tag is None:
+        tag = buf.find(b"<Data>")
+    if tag < 0:
+        raise ValueError("No <Data> block found in recorder file")
+    close = buf.find(b"</Data>", tag)
+    if close < 0:
+        if not partial:
+            raise ValueError("truncated recorder: no closing </Data> tag")
+        close = len(buf)
+    start = buf.find(b"\n", tag, close) + 1 or close
+    end = buf.rfind(b"\n", start, close) + 1 or start
+    return tag, start, end
+
+def _seek_row(buf, start, end, n, size=CHUNK_SIZE)->int:
+    "Return the byte offset of the n-th row after start, without parsing any row."
+    for block in _iter_blocks(buf, start, end, size):
+        count = block.count(b"\n")
+        if n < count:
+            for _ in range(n):
+                start = buf.find(b"\n", start, end) + 1
+            return start
+        n -= count
+        start += len(block)
+    return end
+
+def _row_time(buf, row, end)->float:
+    return float(buf[row:buf.find(b"\n", row, end)].split(None, 1)[0])
+
+def _seek_time(buf, start, end, t, right=False)->int:
+    """
+    Bisect the rows in buf[start:end] on their first (time) column and
+    return the byte offset of the first row with time >= t (> t if right).
+    Only the time of O(log nsteps) rows is converted to float.
+    """
+    lo, hi = start, end
+    while lo < hi:
+        row = buf.rfind(b"\n", lo, (lo + hi)//2) + 1 or lo
+        time = _row_time(buf, row, hi)
+        if time < t or (right and time == t):
+            lo = buf.find(b"\n", row, hi) + 1
+        else:
+            hi = row
+    return lo
+
+def _window_range(buf, start, end, keys, t0=None, t1=None, time=False)->tuple:
+    """
+    Narrow the row range buf[start:end] to the window [t0, t1). When `time`
+    is True, t0 and t1 are times and the window is closed, [t0, t1].
+    """
+    if time:
+        if not keys or keys[0] != ("time",):
+            raise ValueError("Recorder has no time column; it was not created with -time")
+        if t0 is not None:
+            start = _seek_time(buf, start, end, t0)
+        if t1 is not None:
+            end = _seek_time(buf, start, end, t1, right=True)
+    else:
+        if t1 is not None:
+            end = _seek_row(buf, start, end, t1)
+        if t0 is not None:
+            start = _seek_row(buf, start, end, t0)
+    return start, end
+
+def _window_array(keys, data, t0=None, t1=None, stride=1, time=False)->np.ndarray:
+    "Apply the same window as _window_range to an already parsed array."
+    if time:
+        if not keys or keys[0] != ("time",):
+            raise ValueError("Recorder has no time column; it was not created with -time")
+        t0 = None if t0 is None else np.searchsorted(data[:, 0], t0, side="left")
+        t1 = None if t1 is None else np.searchsorted(data[:, 0], t1, side="right")
+    return data[t0:t1:stride]
+
+def _check_window(t0=None, t1=None, stride=1, time=False):
+    """
+    Reject windows that the parsers cannot apply alike on every path: row
+    bounds counted from the end, which a streamed recorder does not know
+    in advance, and strides below 1.
+    """
+    if not time and any(t is not None and t < 0 for t in (t0, t1)):
+        raise ValueError(f"Row bounds must not be negative, got t0={t0}, t1={t1}")
+    if int(stride) != stride or stride < 1:
+        raise ValueError(f"stride must be a positive integer, got {stride}")
+
+def _select_columns(keys, elements=None, sections=None, responses=None)->list:
+    "Return the indices of the columns in keys that match the given filters."
+    if elements is not None:
+        elements = {str(e) for e in elements}
+    if sections is not None:
+        sections = {str(s) for s in sections}
+    if responses is not None:
+        responses = set(responses)
+    return [
+        i for i, key in enumerate(keys) if len(key) == 1 or (
+            (elements  is None or key[0] in elements) and
+            (sections  is None or key[1] in sections) and
+            (responses is None or key[2] in responses)
+        )
+    ]
+
+def _parse_rows(buf, start, end, ncols, cols=None, stride=1, size=CHUNK_SIZE)->np.ndarray:
+    """
+    Parse every `stride`-th row in buf[start:end] into a preallocated
+    (nsteps, len(cols)) array, keeping only the columns in `cols` (all
+    when None).
+    """
+    if cols is not None and len(cols) == ncols:
+        cols = None
+    width = ncols if cols is None else len(cols)
+    nrows = -(-_count_rows(buf, start, end, size) // stride)
+    data = np.empty((nrows, width), dtype=np.float64)
+    row = 0  # rows scanned
+    out = 0  # rows stored
+    for block in _iter_blocks(buf, start, end, size):
+        rows = _parse_block(block, ncols)
+        keep = rows[(-row) % stride::stride]
+        data[out:out+len(keep)] = keep if cols is None else keep[:, cols]
+        row += len(rows)
+        out += len(keep)
+    return data[:out]
+
+def _parse_block(block, ncols)->np.ndarray:
+    values = np.fromstring(block, dtype=np.float64, sep=" ")
+    if values.size % ncols:
+        raise ValueError(f"Recorder row does not have {ncols} columns")
+    return values.reshape((-1, ncols))
+
+# Compressed recorders are read as streams, since they cannot be mapped
+COMPRESSED = (".gz", ".zst", ".xz")
+# and recorders created with -binary are mapped (see read_sect_bin)
+BINARY = ".bin"
+
+def open_recorder(filename, mode="rb"):
+    "Open a recorder file, decompressing it on the fly if it ends in .gz, .zst or .xz."
+    suffix = Path(filename).suffix
+    if suffix == ".gz":
+        return gzip.open(filename, mode)
+    elif suffix == ".xz":
+        return lzma.open(filename, mode)
+    elif suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst recorders requires the zstandard package")
+        return zstandard.open(filename, mode)
+    else:
+        return open(filename, mode)
+
+def find_recorder(filename)->Path:
+    """
+    Return filename, or its compressed or binary (.bin) version if only
+    that exists.
+    """
+    for suffix in ("", *COMPRESSED):
+        if (path := Path(str(filename) + suffix)).exists():
+            return path
+    if (path := Path(filename).with_suffix(BINARY)).exists():
+        return path
+    raise FileNotFoundError(filename)
+
+def compress_recorders(*paths, fmt="gz", remove=False)->list:
+    """
+    Compress the .txt recorder files under each of `paths` (directories are
+    searched recursively) to `fmt`, one of gz, zst or xz. Files that are
+    already compressed in another format are recompressed. Data is streamed
+    so no file is ever fully inflated. Returns the new file names.
+    """
+    written = []
+    for path in map(Path, paths):
+        files = [path] if path.is_file() else [
+            f for f in path.rglob("*.txt*")
+            if f.suffix == ".txt" or (f.suffix in COMPRESSED and f.suffixes[-2:-1] == [".txt"])
+        ]
+        for file in files:
+            base = file.with_suffix("") if file.suffix in COMPRESSED else file
+            target = Path(f"{base}.{fmt}")
+            if target == file:
+                continue
+            tmp = target.with_name(".tmp-" + target.name)
+            with open_recorder(file, "rb") as src, open_recorder(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            shutil.copystat(file, tmp)
+            os.replace(tmp, target)
+            if remove:
+                file.unlink()
+            written.append(target)
+    return written
+
+def _iter_stream_blocks(stream, head, size=CHUNK_SIZE):
+    """
+    Yield newline-aligned blocks of rows from `stream`, starting with the
+    bytes in `head`, until the closing </Data> tag. A stream that ends
+    before the tag is an error.
+    """
+    rest = head
+    while True:
+        chunk = stream.read(size)
+        buf = rest + chunk
+        if (close := buf.find(b"</Data>")) < 0 and not chunk:
+            raise ValueError("truncated recorder: no closing </Data> tag")
+        if close >= 0:
+            buf = buf[:close]
+            yield buf[:buf.rfind(b"\n") + 1]
+            return
+        end = buf.rfind(b"\n") + 1
+        yield buf[:end]
+        rest = buf[end:]
+
+def _parse_stream(blocks, keys, cols=None, t0=None, t1=None, stride=1, time=False)->np.ndarray:
+    """
+    Parse the rows of a stream of blocks from _iter_stream_blocks, keeping
+    the same window and columns as _window_range and _parse_rows do for a
+    mapped file. Blocks outside the window are skipped without parsing.
+    The rows are kept in one array that is grown geometrically in place,
+    so the data is not held twice.
+    """
+    ncols = len(keys)
+    width = ncols if cols is None else len(cols)
+    data = np.empty((0, width))
+    out  = 0  # rows stored
+    seen = 0  # rows read from the stream
+    row  = 0  # rows of the window scanned, for stride
+    for block in blocks:
+        n = block.count(b"\n")
+        if n == 0:
+            continue
+        if time:
+            if t0 is not None and _row_time(block, block.rfind(b"\n", 0, len(block)-1) + 1, len(block)) < t0:
+                continue
+            if t1 is not None and _row_time(block, 0, len(block)) > t1:
+                break
+            start, end = _window_range(block, 0, len(block), keys, t0, t1, time=True)
+        else:
+            lo = 0 if t0 is None else max(0, t0 - seen)
+            hi = n if t1 is None else min(n, t1 - seen)
+            seen += n
+            if hi <= lo:
+                if t1 is not None and seen >= t1:
+                    break
+                continue
+            start, end = (0, len(block)) if lo == 0 and hi == n else \
+                         _window_range(block, 0, len(block), keys, lo, hi)
+
+        rows = _parse_block(block[start:end], ncols)
+        keep = rows[(-row) % stride::stride]
+        if out + len(keep) > len(data):
+            data.resize((max(2*len(data), out + len(keep)), width), refcheck=False)
+        data[out:out+len(keep)] = keep if cols is None or len(cols) == ncols else keep[:, cols]
+        row += len(rows)
+        out += len(keep)
+
+    data.resize((out, width), refcheck=False)
+    return data
+
+# Parsed recorders are cached next to the source file as
+#   eleDef1.txt.cache.npy   (nsteps, ncached) float64 data of the columns
+#                           read so far
+#   eleDef1.txt.cache.json  fingerprint of the source, its column index and
+#                           the source columns held in the .npy ("cached")
+CACHE_SUFFIX = ".cache"
+# Number of bytes hashed from each end of the source file
+CACHE_HASH_BYTES = 1 << 20
+
+def _cache_paths(filename)->tuple:
+    filename = Path(filename)
+    base = filename.parent/(filename.name + CACHE_SUFFIX)
+    return base.with_name(base.name + ".npy"), base.with_name(base.name + ".json")
+
+def _fingerprint(filename)->dict:
+    """
+    Identify the current contents of a recorder file by its size, mtime and
+    a hash of its first and last CACHE_HASH_BYTES.
+    """
+    stat = os.stat(filename)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as f:
+        digest.update(f.read(CACHE_HASH_BYTES))
+        if stat.st_size > 2*CACHE_HASH_BYTES:
+            f.seek(-CACHE_HASH_BYTES, os.SEEK_END)
+        digest.update(f.read(CACHE_HASH_BYTES))
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+def _index_keys(index)->list:
+    "Invert a nested {element: {section: {response: column}}} index."
+    keys = {}
+    for ele, sects in index.items():
+        if isinstance(sects, int):
+            keys[sects] = (ele,)
+            continue
+        for sect, resps in sects.items():
+            for resp, col in resps.items():
+                keys[col] = (ele, sect, resp)
+    return [keys[i] for i in range(len(keys))]
+
+def _load_cache(filename):
+    """
+    Return (keys, cached, data) from the sidecar of filename, where keys
+    are the columns of the source and data holds the columns in `cached`;
+    or None if the sidecar is missing or stale.
+    """
+    npy_file, json_file = _cache_paths(filename)
+    try:
+        with open(json_file, "r") as f:
+            index = json.load(f)
+        if index["source"] != _fingerprint(filename):
+            return None
+        keys = _index_keys(index["columns"])
+        cached = index.get("cached", list(range(len(keys))))
+        data = np.load(npy_file, mmap_mode="r")
+        if data.ndim != 2 or data.shape[1] != len(cached):
+            return None
+        return keys, cached, data
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_cache(filename, keys, cached, data):
+    npy_file, json_file = _cache_paths(filename)
+    columns = defaultdict(lambda: defaultdict(dict))
+    for i, key in enumerate(keys):
+        if len(key) == 1:
+            columns[key[0]] = i
+        else:
+            columns[key[0]][key[1]][key[2]] = i
+    # Temporary files are named by process, so that processes caching the
+    # same recorder at once do not write into each other's file.
+    suffix = f".{os.getpid()}.tmp"
+    tmp = None
+    try:
+        # Write the index last so an interrupted write is never mistaken
+        # for a valid cache.
+        tmp = npy_file.with_name(npy_file.name + suffix)
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, npy_file)
+        tmp = json_file.with_name(json_file.name + suffix)
+        with open(tmp, "w") as f:
+            json.dump({"source": _fingerprint(filename), "columns": columns,
+                       "cached": list(map(int, cached))}, f)
+        os.replace(tmp, json_file)
+    except OSError:
+        if tmp is not None and tmp.exists():
+            tmp.unlink()
+
+def clean_cache(*paths)->int:
+    """
+    Remove the sidecar cache files under each of `paths` (directories are
+    searched recursively). Returns the number of files removed.
+    """
+    count = 0
+    for path in map(Path, paths):
+        files = path.rglob(f"*{CACHE_SUFFIX}.*") if path.is_dir() else _cache_paths(path)
+        for file in files:
+            if file.name.endswith((f"{CACHE_SUFFIX}.npy", f"{CACHE_SUFFIX}.json")) and file.exists():
+                file.unlink()
+                count += 1
+    return count
+
+def _read_mapped(filename, select, stride, window)->tuple:
+    with open(filename, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        tag, keys = _read_schema(mm)
+        tag, start, end = _data_range(mm, tag)
+        cols = select(keys)
+        start, end = _window_range(mm, start, end, keys, **window)
+        return keys, cols, _parse_rows(mm, start, end, len(keys), cols, stride)
+
+def _read_stream_header(f)->tuple:
+    "Read up to the <Data> tag of stream f; return the column keys and the bytes after the tag line."
+    head = b""
+    while (tag := head.find(b"<Data>")) < 0:
+        if not (chunk := f.read(CHUNK_SIZE)):
+            raise ValueError("No <Data> block found in recorder file")
+        head += chunk
+    _, keys = _read_schema(head)
+    start = head.find(b"\n", tag)
+    start = len(head) if start < 0 else start + 1
+    return keys, head[start:]
+
+def _read_stream(filename, select, stride, window)->tuple:
+    with open_recorder(filename) as f:
+        keys, head = _read_stream_header(f)
+        cols = select(keys)
+        blocks = _iter_stream_blocks(f, head)
+        return keys, cols, _parse_stream(blocks, keys, cols, stride=stride, **window)
+
+def read_sect_xml4(filename: str, elements=None, responses=None, sections=None,
+                   t0=None, t1=None, stride=1, time=False, cache=True)->dict:
+    """
+    Memory-mapped variant of read_sect_xml3. The <Data> block is parsed in
+    pieces of CHUNK_SIZE bytes straight into the output array, so peak
+    memory stays close to the size of the parsed data. The result is a
+    ResponseTable, which can also be used like the dict of read_sect_xml3.
+
+    When `elements`, `sections` or `responses` are given, only the matching
+    columns are kept, e.g. ``responses=("eps", "kappaZ", "kappaY")``.
+
+    `t0`, `t1` and `stride` read every stride-th step in [t0, t1), like a
+    slice. With `time=True`, t0 and t1 are analysis times, looked up in the
+    time column of recorders created with -time, and both are included.
+    Rows outside the window are skipped without being parsed. Row bounds
+    must not be negative, as the length of a streamed recorder is not known
+    until it has been read.
+
+    With `cache` the columns that are read are saved to a binary sidecar,
+    along with those saved by earlier reads, and later reads of columns in
+    the sidecar memory-map it instead of parsing the text, for as long as
+    the source file is unchanged. Reads that ask for a window are not
+    cached. Use clean_cache to remove the sidecars.
+
+    Recorders compressed with gzip, zstd or xz (.gz, .zst, .xz) are
+    decompressed as a stream into the same chunked parser, and are never
+    cached, so that they are not stored inflated on disk. Binary
+    recorders (.bin) are read with read_sect_bin.
+    """
+    _check_window(t0, t1, stride, time)
+    if Path(filename).suffix == BINARY:
+        return read_sect_bin(filename, elements=elements, responses=responses, sections=sections,
+                             t0=t0, t1=t1, stride=stride, time=time)
+
+    window = dict(t0=t0, t1=t1, time=time)
+    windowed = t0 is not None or t1 is not None or stride != 1
+    # a sidecar would hold a compressed recorder fully inflated
+    cache = cache and Path(filename).suffix not in COMPRESSED
+
+    cached = []
+    if cache and (found := _load_cache(filename)) is not None:
+        keys, cached, data = found
+        cols = _select_columns(keys, elements, sections, responses)
+        if set(cols) <= set(cached):
+            # the time column, if any, is always cached first
+            data = _window_array(keys, data, stride=stride, **window)
+            if len(cols) != len(cached):
+                data = data[:, np.searchsorted(cached, cols)]
+            return ResponseTable([keys[i] for i in cols], data)
+
+    cache = cache and not windowed
+    def select(keys):
+        cols = _select_columns(keys, elements, sections, responses)
+        if not cache:
+            return cols
+        # parse only the selection, plus the columns cached before
+        return sorted(set(cols) | set(cached) | ({0} if keys and keys[0] == ("time",) else set()))
+
+    if Path(filename).suffix in COMPRESSED:
+        keys, cols, data = _read_stream(filename, select, stride, window)
+    else:
+        keys, cols, data = _read_mapped(filename, select, stride, window)
+
+    if cache:
+        _save_cache(filename, keys, cols, data)
+        selected = _select_columns(keys, elements, sections, responses)
+        if selected != cols:
+            data = data[:, np.searchsorted(cols, selected)]
+        cols = selected
+
+    return ResponseTable([keys[i] for i in cols], data)
+
+def iter_sect_xml4(filename: str, elements=None, responses=None, sections=None,
+                   size=CHUNK_SIZE):
+    """
+    Read a section recorder in pieces, yielding a ResponseTable for every
+    `size` bytes or so of rows, so that long recorders can be processed one
+    chunk of steps at a time. The filters are those of read_sect_xml4, and
+    compressed and binary recorders are read in the same way.
+    """
+    if Path(filename).suffix == BINARY:
+        table = read_sect_bin(filename)
+        cols = _select_columns(table.keys, elements, sections, responses)
+        names = [table.keys[i] for i in cols]
+        rows = max(1, size // (8*len(table.keys)))
+        for start in range(0, table.nsteps, rows):
+            yield ResponseTable(names, np.array(table.data[start:start+rows, cols]))
+    elif Path(filename).suffix in COMPRESSED:
+        with open_recorder(filename) as f:
+            keys, head = _read_stream_header(f)
+            cols = _select_columns(keys, elements, sections, responses)
+            names = [keys[i] for i in cols]
+            for block in _iter_stream_blocks(f, head, size):
+                if block:
+                    yield ResponseTable(names, _parse_block(block, len(keys))[:, cols])
+    else:
+        with open(filename, "rb") as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            tag, keys = _read_schema(mm)
+            tag, start, end = _data_range(mm, tag)
+            cols = _select_columns(keys, elements, sections, responses)
+            names = [keys[i] for i in cols]
+            for block in _iter_blocks(mm, start, end, size):
+                yield ResponseTable(names, _parse_block(block, len(keys))[:, cols])
+
+# Binary recorders
+#
+# Recorders created with -binary hold each row as raw native doubles
+# followed by a newline (BinaryFileStream::write), and have no header, so their columns are read from an xml header: the output
+# of the same recorder with -xml, or a file with only its header (see
+# recorderPlan.py -binary). The rows are memory-mapped, not parsed.
+
+def binary_header(filename)->Path:
+    "The xml header that describes the columns of binary recorder `filename`."
+    return Path(filename).with_suffix(".xml")
+
+def read_header(filename)->list:
+    "Column keys of an xml recorder, or of a file with only the header of one."
+    head = b""
+    with open_recorder(filename) as f:
+        while (tag := head.find(b"<Data>")) < 0 and (chunk := f.read(CHUNK_SIZE)):
+            head += chunk
+    return _read_header(head[:tag if tag >= 0 else len(head)].splitlines())
+
+def read_sect_bin(filename: str, header=None, elements=None, responses=None, sections=None,
+                  t0=None, t1=None, stride=1, time=False)->ResponseTable:
+    """
+    Read a recorder created with -binary into a ResponseTable like that of
+    read_sect_xml4, with the same filters and window. The columns are taken
+    from `header`, either a list of keys or an xml file (by default
+    binary_header(filename)). The data array is a strided view of a memory
+    map of the file, unless columns are selected; a partly written last row
+    is left out.
+    """
+    _check_window(t0, t1, stride, time)
+    if header is None or isinstance(header, (str, os.PathLike)):
+        keys = read_header(binary_header(filename) if header is None else header)
+    else:
+        keys = [tuple(key) for key in header]
+    if not keys:
+        raise ValueError(f"No columns found in the header of {filename}")
+
+    ncols = len(keys)
+    row = np.dtype([("data", np.float64, (ncols,)), ("end", "S1")])
+    nrows = os.path.getsize(filename) // row.itemsize
+    if nrows == 0:
+        data = np.empty((0, ncols))
+    else:
+        rows = np.memmap(filename, dtype=row, mode="r", shape=(nrows,))
+        if rows["end"][0] != b"\n" or rows["end"][-1] != b"\n":
+            raise ValueError(f"Rows of {filename} do not have the {ncols} columns of its header")
+        data = rows["data"]
+    data = _window_array(keys, data, t0, t1, stride, time)
+    cols = _select_columns(keys, elements, sections, responses)
+    if len(cols) != len(keys):
+        data = data[:, cols]
+    return ResponseTable([keys[i] for i in cols], data)
+
+class FollowReader:
+    """
+    Incrementally read a section recorder that OpenSees is still writing.
+
+    Each call to poll() returns a ResponseTable holding only the
+    complete rows written since the previous call, or None when there are
+    none yet. A row that is only partly written is left for the next poll.
+    `nrows` counts the rows returned so far, and `done` is set once the
+    closing </Data> tag has been read.
+    """
+    def __init__(self, filename, elements=None, responses=None, sections=None):
+        self.filename = filename
+        self.filters = elements, sections, responses
+        self.keys = None
+        self.cols = None
+        self.offset = None
+        self.nrows = 0
+        self.done = False
+
+    def _start(self)->bool:
+        "Parse the header once the <Data> tag is in the file."
+        try:
+            with open(self.filename, "rb") as f:
+                head = b""
+                while block := f.read(CHUNK_SIZE):
+                    head += block
+                    if (tag := head.find(b"<Data>")) >= 0:
+                        break
+                else:
+                    return False
+        except FileNotFoundError:
+            return False
+
+        if head.find(b"\n", tag) < 0:
+            return False
+        self.keys = _read_schema(head)[1]
+        self.cols = _select_columns(self.keys, *self.filters)
+        # the recorder is still being written, so </Data> may be missing
+        _, self.offset, _ = _data_range(head, tag, partial=True)
+        return True
+
+    def poll(self):
+        if self.done or (self.offset is None and not self._start()):
+            return None
+
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            buf = f.read()
+
+        if (close := buf.find(b"</Data>")) >= 0:
+            buf = buf[:close]
+            self.done = True
+
+        end = buf.rfind(b"\n") + 1
+        if end == 0:
+            return None
+        data = _parse_rows(buf, 0, end, len(self.keys), self.cols)
+        self.offset += end
+        self.nrows += len(data)
+        return ResponseTable([self.keys[i] for i in self.cols], data)
+
+def follow_sect_xml(filename, interval=1.0, **kwds):
+    "Yield the new rows of a recorder as they are written; see FollowReader."
+    reader = FollowReader(filename, **kwds)
+    while not reader.done:
+        if (data := reader.poll()) is None:
+            time.sleep(interval)
+        else:
+            yield data
+
 def read_sect_xml1(xml_file):
     root = ET.parse(xml_file).getroot()
 
@@ -154,3 +1010,23 @@ def read_sect_xml0(xml_file):
     getDictData(data, dataDict)
     return dataDict
 
+
+if __name__ == "__main__":
+    # python xmlutils.py --clean-cache <path>...
+    # python xmlutils.py --compress [-f gz|zst|xz] [--remove] <path>...
+    argi = iter(sys.argv[1:])
+    for arg in argi:
+        if arg == "--clean-cache":
+            print(clean_cache(*argi), "cache files removed")
+
+        elif arg == "--compress":
+            fmt, remove, paths = "gz", False, []
+            for arg in argi:
+                if arg == "-f":
+                    fmt = next(argi)
+                elif arg == "--remove":
+                    remove = True
+                else:
+                    paths.append(arg)
+            for file in compress_recorders(*paths, fmt=fmt, remove=remove):
+                print(file)
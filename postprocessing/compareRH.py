@@ -11,6 +11,7 @@ import sys, yaml
 import numpy as np
 from math import pi
 from matplotlib import pyplot as plt
+from xmlutils import open_recorder
 
 NAME = "compareRH.py"
 
@@ -28,7 +29,8 @@ Positional Arguments:
   <metric>                      string defining desired RH comparison metric.
                                 one of the following metrics:
                                 {METRICS}.
-  <trueRH-file>                 text file of true response history, or - if from stdin
+  <trueRH-file>                 text file of true response history, or - if from stdin.
+                                files ending in .gz, .zst or .xz are decompressed.
   <testRH-file>                 text file of test response history.
 
 Options:
@@ -89,6 +91,14 @@ def parse_args(argv) -> dict:
             opts["testRH-file"] = arg
     return opts
 
+# Response histories may be compressed with gzip, zstd or xz, like recorders
+def open_file(filename, mode="rt"):
+    return open_recorder(filename, mode) if isinstance(filename, str) else filename
+
+def load_file(filename):
+    with open_file(filename) as f:
+        return np.loadtxt(f)
+
 # Helper functions for each metric
 def Diff(trueRH, testRH):
     out = testRH - trueRH
@@ -171,13 +181,13 @@ if __name__ == "__main__":
 
     # Read in the RH data.
     if ".yaml" in opts["trueRH-file"]:
-        with open(opts["trueRH-file"], "r") as f:
+        with open_file(opts["trueRH-file"], "rt") as f:
             trueData = yaml.load(f, Loader=yaml.CSafeLoader)
         trueRH = np.array([trueData[t][opts["node"]][opts["dof"]-1] for t in trueData])
     else:
-        trueRH = np.loadtxt(opts["trueRH-file"])
+        trueRH = load_file(opts["trueRH-file"])
     trueRH = trueRH - [trueRH[0]]*len(trueRH)
-    testRH = np.loadtxt(opts["testRH-file"])
+    testRH = load_file(opts["testRH-file"])
     testRH = testRH - [testRH[0]]*len(testRH)
     
     # If accel RH (as opposed to disp or vel), generate husid plot and restrict
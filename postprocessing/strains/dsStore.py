@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Consolidated store of strain-based damage states for a suite of GMs.
+
+    python dsStore.py [--compact] <store>
+
+The store is a directory of .npz chunks, each holding the results of one
+or more GMs:
+
+    gm      (ngm,)              GM directory names
+    elems   (nele,)             element tags
+    ds      (ngm, nele)         most severe damage state of each element
+    time    (ngm, nele)         timepoint of that damage state
+    timeDS  (ngm, nds, nele)    timepoint of every damage state (0 if none)
+    dsrs    (nds,)              damage state regions, in the order of timeDS
+    stamp   (ngm,)              time at which each row was written (ns)
+
+Every writer creates its own uniquely named chunk and renames it into
+place, so any number of processes can add to a store at once. A GM that
+appears in more than one chunk is read from the most recent one.
+Without options the GMs in the store are summarized; --compact merges
+all chunks into one.
+"""
+import os
+import sys
+import glob
+import time
+import socket
+import itertools
+
+import numpy as np
+
+_count = itertools.count()
+
+def _chunks(store)->list:
+    return sorted(glob.glob(os.path.join(store, "part-*.npz")))
+
+def write_chunk(store, gms, elems, ds, time_, timeDS, dsrs, stamp=None)->str:
+    "Add the results of the GMs in `gms` to the store as a new chunk."
+    os.makedirs(store, exist_ok=True)
+    name = f"part-{socket.gethostname()}-{os.getpid()}-{time.time_ns()}-{next(_count)}.npz"
+    if stamp is None:
+        stamp = np.full(len(gms), time.time_ns(), dtype=np.int64)
+    tmp = os.path.join(store, "." + name)
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f,
+            gm=np.asarray(gms, dtype=str),
+            elems=np.asarray(elems, dtype=int),
+            ds=np.asarray(ds, dtype=np.int8).reshape(len(gms), -1),
+            time=np.asarray(time_, dtype=float).reshape(len(gms), -1),
+            timeDS=np.asarray(timeDS, dtype=float).reshape(len(gms), len(dsrs), -1),
+            dsrs=np.asarray(dsrs, dtype=str),
+            stamp=np.asarray(stamp, dtype=np.int64)
+        )
+    os.replace(tmp, os.path.join(store, name))
+    return os.path.join(store, name)
+
+
+def read_gms(store)->set:
+    "Names of the GMs in the store."
+    gms = set()
+    for chunk in _chunks(store):
+        with np.load(chunk) as data:
+            gms.update(data["gm"].tolist())
+    return gms
+
+
+def read_store(store, chunks=None)->dict:
+    """
+    Load every chunk of the store into arrays laid out like a single chunk,
+    with one row per GM and the union of the elements of all chunks, in
+    the order they first appear (that of the csv files of fiberStrains.py).
+    Elements that a GM was not evaluated for have ds -1 and NaN times.
+    """
+    parts = []
+    for chunk in (_chunks(store) if chunks is None else chunks):
+        with np.load(chunk) as data:
+            parts.append({k: data[k] for k in data.files})
+    if not parts:
+        raise FileNotFoundError(f"No damage state chunks in {store}")
+
+    dsrs = parts[0]["dsrs"]
+    if any(not np.array_equal(p["dsrs"], dsrs) for p in parts):
+        raise ValueError(f"Chunks in {store} have different damage state regions")
+
+    elems = np.array(list(dict.fromkeys(np.concatenate([p["elems"] for p in parts]).tolist())), dtype=int)
+    column = {e: i for i, e in enumerate(elems.tolist())}
+    gm    = np.concatenate([p["gm"] for p in parts])
+    stamp = np.concatenate([p["stamp"] for p in parts])
+
+    # keep the latest row of each GM
+    order = np.lexsort((-stamp, gm))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = gm[order][1:] != gm[order][:-1]
+    keep = order[first]
+
+    ngm, nele = len(gm), len(elems)
+    ds     = np.full((ngm, nele), -1, dtype=np.int8)
+    time_  = np.full((ngm, nele), np.nan)
+    timeDS = np.full((ngm, len(dsrs), nele), np.nan)
+    row = 0
+    for p in parts:
+        n = len(p["gm"])
+        cols = [column[e] for e in p["elems"].tolist()]
+        ds[row:row+n, cols] = p["ds"]
+        time_[row:row+n, cols] = p["time"]
+        timeDS[row:row+n, :, cols] = p["timeDS"]
+        row += n
+
+    return {
+        "gm": gm[keep], "elems": elems, "ds": ds[keep], "time": time_[keep],
+        "timeDS": timeDS[keep], "dsrs": dsrs, "stamp": stamp[keep]
+    }
+
+
+def compact_store(store)->int:
+    "Merge all chunks of the store into one; return the number of GMs."
+    chunks = _chunks(store)
+    if len(chunks) < 2:
+        return len(read_gms(store))
+    data = read_store(store, chunks)
+    write_chunk(store, data["gm"], data["elems"], data["ds"], data["time"],
+                data["timeDS"], data["dsrs"], data["stamp"])
+    # chunks added while compacting are left alone
+    for chunk in chunks:
+        os.remove(chunk)
+    return len(data["gm"])
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] in ["-h", "--help"]:
+        print(__doc__)
+        sys.exit()
+
+    if args[0] == "--compact":
+        for store in args[1:]:
+            print(f"{store}: {compact_store(store)} GMs", file=sys.stderr)
+    else:
+        for store in args:
+            data = read_store(store)
+            print(f"{store}: {len(data['gm'])} GMs, {len(data['elems'])} elements, "
+                  f"{len(_chunks(store))} chunks")
@@ -1,7 +1,11 @@
-import json, sys, fnmatch
+import os, sys, json, fnmatch, hashlib
 
 import numpy as np
 from opensees import patch, section
+try:
+    from profiler import stage
+except ImportError:
+    from contextlib import nullcontext as stage
 # from xmlutils import read_sect_xml3 as read_sect_xml
 
 HELP = """
@@ -12,6 +16,11 @@ Options
 -logging <int>          logging flag
 -d <float>              section diameter
 -s <int>,[<int>]        section tag range
+-binary                 binary output (with -multi)
+-multi                  one fiberData recorder per element section instead of
+                        one recorder per fiber; the columns of every recorder
+                        are described in a JSON manifest
+-manifest <file>        manifest file name (default output.json)
 
 To install run:
     python fiberRecorders.py --setup develop
@@ -23,7 +32,7 @@ def damage_states(Dcol):
     cover = 2.0
     Rcol = Dcol/2
     coverl = cover + Rcol*(1-np.cos(np.pi/8))
-    return {
+    states = {
         "dsr0": {
             "regions": [
                 # external radius    internal radius
@@ -77,6 +86,189 @@ def damage_states(Dcol):
             ]
         }
     }
+    # "key" identifies the region in the fiber index (see fiber_index); it
+    # includes a digest of the definition, so that saved indices of a
+    # region whose geometry or material filter has changed are not reused
+    for name, state in states.items():
+        state["key"] = f"{name}@{Dcol:g}#{region_digest(state)}"
+    return states
+
+# --8<--------------------------------------------------------
+# Fiber membership index
+#
+# Testing every fiber of a section against the damage state regions
+# one point at a time dominates the cost of iter_elem_fibers. The
+# functions below do the test once per (section, region) pair for all
+# fibers at once and keep the resulting fiber indices in model["fiber_index"],
+# so that subsequent selections are an array lookup. The index can be
+# saved next to the model file and is keyed by the hash of the model.
+
+_EPS  = 0.00001
+_HUGE = sys.float_info.max
+_TINY = sys.float_info.min
+
+def _ray_cast(vertices, points)->np.ndarray:
+    "Vectorized form of the ray casting test used by opensees' polygon patches"
+    v = np.asarray(vertices, dtype=float)
+    px, py = points[:,0], points[:,1]
+    count = np.zeros(len(points), dtype=int)
+    for i in range(len(v)):
+        a, b = v[i-1], v[i]
+        if a[1] > b[1]:
+            a, b = b, a
+        y = np.where((py == a[1]) | (py == b[1]), py + _EPS, py)
+
+        outside = (y > b[1]) | (y < a[1]) | (px > max(a[0], b[0]))
+        left = px < min(a[0], b[0])
+
+        if abs(a[0] - b[0]) > _TINY:
+            m_red = (b[1] - a[1]) / float(b[0] - a[0])
+        else:
+            m_red = _HUGE
+        dx = px - a[0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            m_blue = np.where(np.abs(dx) > _TINY, (y - a[1])/dx, _HUGE)
+
+        count += ~outside & (left | (m_blue >= m_red))
+    return count % 2 == 1
+
+
+def region_contains(region, points)->np.ndarray:
+    """
+    Return a boolean array which is True for each row of `points`
+    that lies in `region`; equivalent to `[p in region for p in points]`.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+
+    if hasattr(region, "areas"):
+        inside = np.zeros(len(points), dtype=bool)
+        for area in region.areas:
+            inside |= region_contains(area, points)
+        return inside
+
+    elif all(hasattr(region, a) for a in ("intRad", "extRad", "startAng", "endAng")):
+        # patch.circ
+        vect = points - np.asarray(region.center, dtype=float)
+        size = np.sqrt(vect[:,0]**2 + vect[:,1]**2)
+        angl = (np.arctan2(vect[:,1], vect[:,0]) + 2*np.pi) % 2*np.pi
+        return (size < region.extRad) & (size > region.intRad) \
+             & (angl > region.startAng) & (angl < region.endAng)
+
+    elif len(getattr(region, "vertices", ())) > 2:
+        # patch.quad, patch.rect
+        return _ray_cast(region.vertices, points)
+
+    else:
+        return np.fromiter((list(p) in region for p in points),
+                           dtype=bool, count=len(points))
+
+
+def _region_params(region):
+    "The parameters of `region` that region_contains depends on."
+    if hasattr(region, "areas"):
+        return [_region_params(area) for area in region.areas]
+    elif all(hasattr(region, a) for a in ("intRad", "extRad", "startAng", "endAng")):
+        return ["circ", *np.asarray(region.center, dtype=float).tolist(),
+                *(float(getattr(region, a)) for a in ("intRad", "extRad", "startAng", "endAng"))]
+    elif len(getattr(region, "vertices", ())) > 2:
+        return ["vertices", np.asarray(region.vertices, dtype=float).tolist()]
+    else:
+        return [type(region).__name__, repr(sorted(
+            (k, v) for k, v in vars(region).items() if not k.startswith("_")
+        ))]
+
+def region_digest(filt)->str:
+    "Short hash of the regions and material filter of a damage state."
+    definition = {
+        "regions": [_region_params(region) for region in filt["regions"]],
+        "material": filt.get("material")
+    }
+    return hashlib.blake2b(json.dumps(definition).encode(), digest_size=6).hexdigest()
+
+
+def section_coords(model, s)->np.ndarray:
+    "Return an (nfib, 2) array with the fiber coordinates of section s"
+    coords = model.setdefault("fiber_coords", {})
+    name = str(s["name"])
+    if name not in coords:
+        if hasattr(s["fibers"], "coord"):
+            # FiberTable of a compiled model (see modelCache)
+            coords[name] = np.asarray(s["fibers"].coord)
+        else:
+            coords[name] = np.array([f["coord"] for f in s["fibers"]],
+                                    dtype=float).reshape(-1, 2)
+    return coords[name]
+
+
+def fiber_index(model, s, filt)->np.ndarray:
+    """
+    Return the indices into s["fibers"] of the fibers that pass `filt`.
+    Results for filters with a "key" (see damage_states) are cached in
+    model["fiber_index"].
+    """
+    key = filt.get("key", None)
+    if key is not None:
+        key = f"{s['name']}|{key}"
+        index = model.setdefault("fiber_index", {})
+        if key in index:
+            return index[key]
+
+    with stage("fiber_filter"):
+        fibers = s["fibers"]
+        inside = np.zeros(len(fibers), dtype=bool)
+        points = section_coords(model, s)
+        for region in filt["regions"]:
+            inside |= region_contains(region, points)
+
+        if "material" in filt and hasattr(fibers, "materials"):
+            match = np.array([
+                fnmatch.fnmatch(model["materials"][m]["type"].lower(), filt["material"])
+                for m in fibers.materials
+            ], dtype=bool)
+            inside &= match[fibers.material]
+        elif "material" in filt:
+            match = {
+                m: fnmatch.fnmatch(model["materials"][m]["type"].lower(), filt["material"])
+                for m in {f["material"] for f in fibers}
+            }
+            inside &= np.array([match[f["material"]] for f in fibers], dtype=bool)
+        found = np.flatnonzero(inside)
+    if key is not None:
+        index[key] = found
+    return found
+
+
+def index_file(model_file)->str:
+    "Name of the fiber index saved next to model_file"
+    return os.path.splitext(model_file)[0] + ".fibers.npz"
+
+
+def load_fiber_index(model, filename)->int:
+    """
+    Load a fiber index written by save_fiber_index into model["fiber_index"].
+    Nothing is loaded if the file is missing or was written for a different
+    model. Return the number of entries loaded.
+    """
+    try:
+        with np.load(filename) as data:
+            if str(data["model_hash"]) != model.get("hash", ""):
+                return 0
+            entries = {k: data[k] for k in data.files if k != "model_hash"}
+    except (OSError, KeyError, ValueError):
+        return 0
+    model.setdefault("fiber_index", {}).update(entries)
+    return len(entries)
+
+
+def save_fiber_index(model, filename):
+    "Save model['fiber_index'] to filename; failures are ignored."
+    tmp = filename + ".tmp.npz"
+    try:
+        np.savez(tmp, model_hash=np.array(model.get("hash", "")),
+                 **model.get("fiber_index", {}))
+        os.replace(tmp, filename)
+    except OSError:
+        pass
 
 # --8<--------------------------------------------------------
 
@@ -95,15 +287,23 @@ def iter_elem_fibers(model:dict, elements:list, sections: list=(0,-1), filt:dict
         el = model["elements"][str(int(tag))]
         for i in sections:
             idx = len(el["sections"]) - 1 if i==-1 else i
-            tag = el["sections"][idx]
-            s = model["sections"][tag]
-            if "section" in s:
-                s = model["sections"][s["section"]]
+            s = elem_section(model, tag, idx)
+            if s is not None:
                 for f in iter_section_fibers(model, s, filt):
                     yield el,idx+1,f
 
-                        
-                        
+
+def elem_section(model:dict, tag, i:int):
+    """
+    Return the fiber section at integration point i of element `tag`, or
+    None if the section there is not an aggregated fiber section.
+    """
+    el = model["elements"][str(int(tag))]
+    s = model["sections"][el["sections"][i]]
+    if "section" in s:
+        return model["sections"][s["section"]]
+    return None
+
 def iter_elem_strains(model, el, s, filt=None):
     sam = model["StructuralAnalysisModel"]
     model["sections"] = {
@@ -131,18 +331,9 @@ def iter_section_fibers(model, s, filt=None, match=None):
     # elif match == "pattern":
     #     pass
     if filt is not None:
-        if "material" not in filt:
-            filt["material"] = "*"
-        for fiber in s["fibers"]:
-            if (
-                ("material" not in filt) or fnmatch.fnmatch(
-                    model["materials"][fiber["material"]]["type"].lower(),
-                    filt["material"]
-                )
-            ) and any(
-                fiber["coord"] in region for region in filt["regions"]
-            ) :
-                yield fiber
+        fibers = s["fibers"]
+        for i in fiber_index(model, s, filt):
+            yield fibers[i]
     else:
         yield from s["fibers"]
         # for fiber in s["fibers"]:
@@ -158,17 +349,172 @@ def print_fiber(c, s, base_cmd, options):
         print("puts \""+fiber_cmd+"\"")
 
 
-def fiber_strain(recorder_data, el, s, f, t=None):
-    if t is not None:
-        eps = recorder_data[str(el)][str(s)]["eps"][t]
-        kz =  recorder_data[str(el)][str(s)]["kappaZ"][t]
-        ky =  recorder_data[str(el)][str(s)]["kappaY"][t]
+# --8<--------------------------------------------------------
+# Multi-fiber recorders
+#
+# Instead of one recorder (and one file) per fiber, print_section records
+# every fiber of an element section with a single fiberData recorder. Each
+# row holds the time followed by FIBER_DATA for every fiber of the section,
+# in the order of its fibers in the model. The columns are described by a
+# manifest, written by write_manifest and read back by read_manifest_fibers.
+
+FIBER_DATA = ("yCoord", "zCoord", "area", "stress", "strain")
+EXTENSIONS = {"file": ".txt", "xml": ".txt", "binary": ".bin"}
+
+def print_section(model, el, s, sec, base_cmd, options, states=None)->dict:
+    """
+    Print a recorder for all fibers of `sec`, the section at integration
+    point s of element el, and return its manifest entry. With `states`
+    (see damage_states) each fiber lists the regions that contain it.
+    """
+    out_file = os.path.splitext(options["record_file"])[0] + f"_{el}_{s}" + EXTENSIONS[options["format"]]
+    cmd = base_cmd.format(fmt=options["format"], out_file=out_file) \
+        + f"-ele {el} section {s} fiberData;\n"
+    print(cmd)
+    if options["logging"]:
+        print("puts \""+cmd+"\"")
+
+    fibers = sec["fibers"]
+    regions = [[] for _ in range(len(fibers))]
+    for name, state in (states or {}).items():
+        if name != "all":
+            for i in fiber_index(model, sec, state):
+                regions[i].append(name)
+
+    n = len(FIBER_DATA)
+    return {
+        "file": out_file,
+        "element": int(el),
+        "section": int(s),
+        "columns": 1 + n*len(fibers),
+        "fibers": [
+            {
+                "coord": list(map(float, f["coord"])),
+                "area": float(f["area"]),
+                "material": str(f["material"]),
+                "regions": regions[i],
+                "stress": 1 + n*i + FIBER_DATA.index("stress"),
+                "strain": 1 + n*i + FIBER_DATA.index("strain"),
+            } for i, f in enumerate(fibers)
+        ]
+    }
+
+def write_manifest(filename, recorders, options):
+    """
+    Write the manifest of the recorders printed by print_section. Their
+    files are stored relative to the directory of the manifest.
+    """
+    root = os.path.dirname(filename) or "."
+    with open(filename, "w") as f:
+        json.dump({
+            "format": options["format"],
+            "Dcol": options.get("Dcol"),
+            "time": 0,
+            "responses": FIBER_DATA,
+            "recorders": [
+                {**rec, "file": os.path.relpath(rec["file"], root)} for rec in recorders
+            ]
+        }, f, indent=1)
+
+
+def _read_recorder(filename, fmt, rec)->np.ndarray:
+    "Return the (nsteps, ncols) rows of recorder `rec` of a manifest, written in format fmt."
+    if fmt in ("binary", "xml"):
+        from xmlutils import read_sect_xml4, read_sect_bin
+        if fmt == "xml":
+            return read_sect_xml4(filename).data
+        # the columns of a fiberData recorder, labeled as in its xml header
+        keys = [("time",)] + [
+            (str(rec["element"]), str(rec["section"]), r + "_"*i)
+            for i in range(len(rec["fibers"])) for r in FIBER_DATA
+        ]
+        return read_sect_bin(filename, header=keys).data
+    else:
+        ncols = rec["columns"]
+        with open(filename, "rb") as f:
+            values = np.fromstring(f.read(), dtype=np.float64, sep=" ")
+        return values[:len(values) - len(values) % ncols].reshape(-1, ncols)
+
+def read_manifest_fibers(filename, elements=None, region=None, response="strain")->tuple:
+    """
+    Read the recorders of a manifest written by write_manifest and return
+    (fibers, time, values): the manifest entries of the selected fibers,
+    each with its element and section added, the time of every step, and
+    an (nfib, nsteps) array with `response` ("stress" or "strain") of each
+    fiber. Fibers are selected by element and by damage state region.
+    """
+    with open(filename) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(filename)
+
+    if elements is not None:
+        elements = {int(el) for el in elements}
+    selected = []
+    for rec in manifest["recorders"]:
+        if elements is not None and rec["element"] not in elements:
+            continue
+        fibers = [f for f in rec["fibers"] if region is None or region in f["regions"]]
+        if fibers:
+            selected.append((rec, fibers))
+    if not selected:
+        return [], np.empty(0), np.empty((0, 0))
+
+    tables = [
+        _read_recorder(os.path.join(root, rec["file"]), manifest["format"], rec)
+        for rec, _ in selected
+    ]
+    nsteps = min(len(data) for data in tables)
+    nfib = sum(len(fibers) for _, fibers in selected)
+    values = np.empty((nfib, nsteps))
+    found = []
+    for (rec, fibers), data in zip(selected, tables):
+        cols = [f[response] for f in fibers]
+        values[len(found):len(found)+len(fibers)] = data[:nsteps, cols].T
+        found.extend({"element": rec["element"], "section": rec["section"], **f} for f in fibers)
+    return found, np.array(tables[0][:nsteps, manifest["time"]]), values
+
+
+# Section deformations needed to recover fiber strains
+STRAIN_RESPONSES = ("eps", "kappaZ", "kappaY")
+
+def section_deformations(recorder_data, el, s, t=None)->np.ndarray:
+    "Return the eps, kappaZ and kappaY histories of section s as a (3, nsteps) array"
+    if hasattr(recorder_data, "columns"):
+        # ResponseTable from xmlutils; index the data array directly
+        cols = recorder_data.columns(el, s, STRAIN_RESPONSES)
+        rows = recorder_data.data if t is None else recorder_data.data[t]
+        return rows[..., cols].T
     else:
-        eps = recorder_data[str(el)][str(s)]["eps"]
-        kz =  recorder_data[str(el)][str(s)]["kappaZ"]
-        ky =  recorder_data[str(el)][str(s)]["kappaY"]
+        resp = recorder_data[str(el)][str(s)]
+        return np.array([
+            resp[r] if t is None else resp[r][t] for r in STRAIN_RESPONSES
+        ])
+
+
+def section_strains(coords, deformations, out=None)->np.ndarray:
+    """
+    Return the (nfib, nsteps) strain histories of the fibers at `coords`,
+    an (nfib, 2) array, from the (3, nsteps) section deformations returned
+    by section_deformations:
+
+        strain = [1, -y, x] @ [eps; kappaZ; kappaY]
+
+    The result is written to `out`, an (nfib, nsteps) array, when it is given.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    deformations = np.asarray(deformations)
+    shape = (len(coords),) + deformations.shape[1:]
+    a = np.empty((len(coords), 3))
+    a[:,0] =  1.0
+    a[:,1] = -coords[:,1]
+    a[:,2] =  coords[:,0]
+    if out is not None:
+        return np.matmul(a, deformations, out=out)
+    return np.matmul(a, deformations.reshape(3, -1)).reshape(shape)
 
-    return eps - kz * f["coord"][1] + ky * f["coord"][0]
+
+def fiber_strain(recorder_data, el, s, f, t=None):
+    return section_strains([f["coord"]], section_deformations(recorder_data, el, s, t))[0]
 
 def print_help():
     print(HELP)
@@ -205,7 +551,10 @@ def parse_args(args)->dict:
         "model_file": None,
         "record_file": None,
         "logging": 0,
-        "format": "file"
+        "format": "file",
+        "sections": (0, -1),
+        "multi": False,
+        "manifest": None
     }
     argi = iter(args)
     for arg in argi:
@@ -236,6 +585,14 @@ def parse_args(args)->dict:
             opts["format"] = "file"
         elif arg == "-xml":
             opts["format"] = "xml"
+        elif arg == "-binary":
+            opts["format"] = "binary"
+
+        elif arg == "-multi":
+            opts["multi"] = True
+
+        elif arg == "-manifest":
+            opts["manifest"] = next(argi)
 
         elif arg == "-logging":
             opts["logging"] = next(argi)
@@ -256,14 +613,37 @@ if __name__=="__main__":
 
     opts = parse_args(sys.argv[1:])
 
-    damage_state = damage_states(opts["Dcol"])[opts["state"]]
-
     elements = opts["elements"]
 
     sections = opts["sections"]
 
     with open(opts["model_file"], "r") as f:
         model = json.load(f)
+    sam = model["StructuralAnalysisModel"]
+    model["sections"] = {
+        str(s["name"]): s for s in sam["properties"]["sections"]
+    }
+    model["materials"] = {
+        str(m["name"]): m for m in sam["properties"]["uniaxialMaterials"]
+    }
+    model["elements"] = {
+        str(int(el["name"])): el for el in sam["geometry"]["elements"]
+    }
+
+    if opts["multi"]:
+        states = damage_states(opts["Dcol"]) if "Dcol" in opts else None
+        recorders = []
+        for tag in elements:
+            el = model["elements"][str(int(tag))]
+            for i in sections:
+                idx = len(el["sections"]) - 1 if i==-1 else i
+                if (s := elem_section(model, tag, idx)) is not None:
+                    recorders.append(print_section(model, tag, idx+1, s, base_cmd, opts, states))
+        manifest = opts["manifest"] or os.path.splitext(opts["record_file"])[0] + ".json"
+        write_manifest(manifest, recorders, opts)
+        sys.exit()
+
+    damage_state = damage_states(opts["Dcol"])[opts["state"]]
 
     for e,s,f in iter_elem_fibers(model, elements, sections, damage_state):
         elem_cmd = base_cmd + f"-ele {e['name']} "
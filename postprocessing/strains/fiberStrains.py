@@ -2,14 +2,23 @@
 # Chrystal Chern cchern@berkeley.edu
 
 import json
-import os, re, sys
-from pathlib import Path
+import os, re, sys, glob, time, hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
 # from matplotlib import pyplot as plt
 # from matplotlib import animation
-from fiberRecorders import iter_elem_fibers, damage_states, fiber_strain
-from xmlutils import read_sect_xml3 as read_sect_xml
+from fiberRecorders import damage_states, STRAIN_RESPONSES, \
+                           index_file, load_fiber_index, save_fiber_index, \
+                           elem_section, fiber_index, section_coords, \
+                           section_deformations, section_strains
+from xmlutils import read_sect_xml4 as read_sect_xml, iter_sect_xml4, FollowReader, \
+                     find_recorder, open_recorder
+import dsStore
+import modelCache
+import lazyModel
+import profiler
+from profiler import stage
 
 # plt.style.use('brace2.mplstyle')
 
@@ -18,6 +27,7 @@ def print_help():
     fiberStrains.py -a dataDir -dsr dsr -ele elems -sec sec ...
 
     a is path to directory with either section deformation (xml format) or fiber strain (file format) recorder output file.  e.g., datahwd10.1/GM1, or datahwd_col_4010_po, etc.
+    Section deformations recorded with -binary (eleDef<sec>.bin, with the xml header eleDef<sec>.xml) are read in place of eleDef<sec>.txt.
     dsr can be any set of: [dsr0 dsr1 dsr2 dsr3 dsr4 dsr5 dsr6 all], or "7ds".  7ds is equivalent to dsr0,1,2,...,6.
     ele are the set of elements studied, e.g. 3020,4010,4020, or "all" if all (non-interlocking) columns. If not specified, default is 4010.
     
@@ -25,18 +35,75 @@ def print_help():
     -sd
     -vmin <float>
     -vmax <float>
+    -no-cache
+    -lazy
+    -t0 <int> -t1 <int> -stride <int>
+    -time
+    --follow [-interval <float>] [-timeout <float>]
+    --batch <glob> [-j <int>] [-model <file>] [-force] [--dry-run]
+    -store <dir>
+    -envelope
+    --profile [-memory]
     
     sd indicates whether using section deformations. default is using fiber strains.
     vmin and vmax are customized colorbar limits, if defaults must be adjusted.
+    no-cache disables the binary sidecar cache of parsed eleDef files and the
+    compiled model (modelDetails.compiled); remove existing recorder sidecars
+    with `python xmlutils.py --clean-cache dataDir`.
+    lazy decodes only the studied elements and the sections and materials they
+    use from modelDetails.json, using the byte offsets of its entries that are
+    saved to modelDetails.offsets.json on first use (see lazyModel.py).
+    t0, t1 and stride restrict the analysis to every stride-th step in [t0, t1).
+    time makes t0 and t1 analysis times; this needs recorders created with -time,
+    and DS timepoints are then counted from the first step in the window.
+    follow watches the eleDef files of an analysis that is still running and
+    reports damage states as they first occur, polling every interval seconds.
+    It stops with an error if the files do not change for timeout seconds
+    (default 600) before their closing </Data> tag is written, e.g. because
+    the analysis crashed.
+    batch evaluates every GM directory matching glob (quote it) with j worker
+    processes (default: all cores), writing DamageStatesByElement.csv in each.
+    The model is read once, from the first directory unless -model is given.
+    GMs whose inputs, model and parameters are unchanged since their last run
+    (see DamageStatesByElement.manifest.json) are skipped unless -force is
+    given; dry-run lists the GMs that would be evaluated, and why.
+    store also adds the damage states, including the time of every DS, to the
+    consolidated store dir (see dsStore.py); globalSBDS.py reads it in one go.
+    envelope streams the eleDef files one chunk of steps at a time and writes
+    StrainEnvelopes.csv with the peak tension and compression (and their
+    steps), strain reversals and accumulated strain of every fiber in the
+    damage state regions, instead of evaluating damage states.
+    profile records the time and call count of each stage (reading the model
+    and recorders, fiber filtering, strains, thresholds) to profile.json in
+    each GM directory; batch runs also write a summary of all GMs to
+    profile_summary.json. memory also traces the peak memory of each stage,
+    which slows the stages down, so profile time and memory in separate
+    runs. The resident memory of a GM is the growth of the peak while it ran
+    (max_rss_growth_kb); process_max_rss_kb is the peak of the whole worker
+    process. See profiler.py.
 """)
 
 def parse_args(args) -> dict:
     opts = {
         "dsr": None,
-        "ele": None,
+        "elems": None,
         "section_deformations": False,
         "vminset": None,
-        "vmaxset": None
+        "vmaxset": None,
+        "cache": True,
+        "lazy": False,
+        "window": {},
+        "follow": False,
+        "interval": 1.0,
+        "timeout": 600.0,
+        "batch": None,
+        "jobs": None,
+        "model": None,
+        "force": False,
+        "dry_run": False,
+        "store": None,
+        "envelope": False,
+        "profile": False
     }
 
     argi = iter(args)
@@ -55,7 +122,7 @@ def parse_args(args) -> dict:
 
         elif arg == "-ele":
             opts["elems"] =  [
-                int(ele) for ele in next(argi).split(",")
+                ele if ele == "all" else int(ele) for ele in next(argi).split(",")
             ]
 
         elif arg == "-sd":
@@ -67,77 +134,266 @@ def parse_args(args) -> dict:
         elif arg == "-vmax":
             opts["vmaxset"] = next(argi)
 
+        elif arg == "-no-cache":
+            opts["cache"] = False
+
+        elif arg == "-lazy":
+            opts["lazy"] = True
+
+        elif arg in ["-t0", "-t1"]:
+            opts["window"][arg[1:]] = next(argi)
+
+        elif arg == "-stride":
+            opts["window"]["stride"] = int(next(argi))
+
+        elif arg == "-time":
+            opts["window"]["time"] = True
+
+        elif arg == "--follow":
+            opts["follow"] = True
+
+        elif arg == "-interval":
+            opts["interval"] = float(next(argi))
+
+        elif arg == "-timeout":
+            opts["timeout"] = float(next(argi))
+
+        elif arg == "--batch":
+            opts["batch"] = next(argi)
+
+        elif arg == "-j":
+            opts["jobs"] = int(next(argi))
+
+        elif arg == "-model":
+            opts["model"] = next(argi)
+
+        elif arg == "-force":
+            opts["force"] = True
+
+        elif arg == "--dry-run":
+            opts["dry_run"] = True
+
+        elif arg == "-store":
+            opts["store"] = next(argi)
+
+        elif arg == "-envelope":
+            opts["envelope"] = True
+
+        elif arg == "--profile":
+            opts["profile"] = opts["profile"] or True
+
+        elif arg == "-memory":
+            opts["profile"] = "memory"
+
+    # Window bounds are steps unless -time was given
+    bound = float if opts["window"].get("time", False) else int
+    for t in ["t0", "t1"]:
+        if t in opts["window"]:
+            opts["window"][t] = bound(opts["window"][t])
+
     return opts
 
-def getDamageStateStrains(a, dsr, model, elems, strain_data=None):
+# Strain-based damage state regions, from most to least severe, and the
+# strain that marks the onset of each (negative for compression).
+DSRS = ["dsr6", "dsr5", "dsr4", "dsr3", "dsr2", "dsr1", "dsr0"]
+THRESHOLDS = [0.09, -0.011, -0.005, -0.005, -0.005, 0.002, 1.32e-4]
+# Column diameters of the REGIONS1, REGIONS2 and REGIONS3 damage states
+DIAMETERS = (84.0, 66.0, 48.0)
+# Elements evaluated with -ele all (the non-interlocking columns)
+COLUMNS = (2010, 2020, 3010, 3020, 4010, 4020, 5010, 5020, 6010, 6020, 7010, 7020, 8010, 8020,
+           9010, 9020, 10010, 10020, 11010, 11020, 12010, 12020, 12030, 13010, 13020, 14010,
+           14020, 14030)
+
+def damage_section(ele)->str:
+    "Integration point at which damage of element `ele` is evaluated."
+    if np.isin(ele, [2010, 2020, 12010, 12020, 12030, 13010, 13020, 14010, 14020, 14030]):
+        return "4"
+    else:
+        return "1"
+
+def window_steps(window, nsteps):
+    "Recorder step numbers of the `nsteps` rows read with `window`."
+    if not window or window.get("time", False):
+        return np.arange(nsteps)
+    return (window.get("t0") or 0) + np.arange(nsteps)*window.get("stride", 1)
+
+def first_exceedance(eps, thresholds):
+    """
+    Find the first step at which any fiber of the (nfib, nsteps) strain
+    matrix `eps` reaches each threshold. Negative thresholds are reached
+    when eps <= th and positive ones when eps >= th; a threshold of zero
+    is never reached. Fibers whose strain is NaN do not reach any threshold.
+
+    Return an array with the first step for each threshold (-1 where the
+    threshold is never reached), and a list with the indices of the fibers
+    that reach it at that step.
+    """
+    first = np.full(len(thresholds), -1)
+    fibers = [np.empty(0, dtype=int) for _ in thresholds]
+    if eps.shape[0] == 0 or eps.shape[1] == 0:
+        return first, fibers
+
+    # one reduction over the fibers serves every threshold of a sign;
+    # fmin/fmax skip fibers with NaN strains, like the comparisons do
+    emin = emax = None
+    for i, th in enumerate(thresholds):
+        if th < 0:
+            if emin is None:
+                emin = np.fmin.reduce(eps, axis=0)
+            hit = emin <= th
+        elif th > 0:
+            if emax is None:
+                emax = np.fmax.reduce(eps, axis=0)
+            hit = emax >= th
+        else:
+            continue
+        t = np.argmax(hit)
+        if hit[t]:
+            first[i] = t
+            fibers[i] = np.flatnonzero((eps[:, t] <= th) if th < 0 else (eps[:, t] >= th))
+    return first, fibers
+
+def element_regions(ele, regions=None)->dict:
+    """
+    Damage state regions of the column section of element `ele`, taken from
+    `regions`, the damage states of each of DIAMETERS (by default
+    REGIONS1, REGIONS2 and REGIONS3).
+    """
+    if regions is None:
+        regions = REGIONS1, REGIONS2, REGIONS3
+    if ele < 12000:
+        return regions[0] # damage_states(84.0)
+    elif ele < 13000:
+        return regions[1] # damage_states(66.0)
+    else:
+        return regions[2] # damage_states(48.0)
+
+def element_strains(a, ele, elems, strain_data, window):
+    "Section deformation data of element `ele`, read into strain_data on first use."
+    data_file = f"eleDef{damage_section(ele)}.txt"
+    if data_file not in strain_data:
+        with stage("read_recorder"):
+            strain_data[data_file] = read_sect_xml(
+                find_recorder(a+f"/{data_file}"), elements=elems, responses=STRAIN_RESPONSES, **window
+            )
+    return strain_data[data_file]
+
+def element_fibers(model, ele, dsr):
+    """
+    Return the coordinates of the distinct fibers of element `ele` that lie
+    in any of the damage state regions `dsr`, and a dict with the rows of
+    these coordinates that belong to each region.
+    """
+    s = elem_section(model, ele, int(damage_section(ele))-1)
+    if s is None:
+        return np.empty((0, 2)), {ds: np.empty(0, dtype=int) for ds in dsr}
+    regions = element_regions(ele)
+    index = {ds: fiber_index(model, s, regions[ds]) for ds in dsr}
+    fibers = np.unique(np.concatenate(list(index.values())))
+    rows = {ds: np.searchsorted(fibers, idx) for ds, idx in index.items()}
+    return section_coords(model, s)[fibers], rows
+
+def getDamageStateStrains(a, dsr, model, elems, strain_data=None, window=None):
     if strain_data is None:
         strain_data = {}
+    if window is None:
+        window = {}
 
     intFrames = 1
 
     epsEle = []
     for ele in elems:
-        if ele < 12000:
-            # regions = damage_states(84.0)
-            regions = REGIONS1
+        regions = element_regions(ele)
+        sec = damage_section(ele)
+        strains = element_strains(a, ele, elems, strain_data, window)
 
-        elif ele < 13000:
-            # regions = damage_states(66.0)
-            regions = REGIONS2
-        else:
-            # regions = damage_states(48.0)
-            regions = REGIONS3
-
-        if np.isin(ele, [2010, 2020, 12010, 12020, 12030, 13010, 13020, 14010, 14020, 14030]):
-            sec = "4"
-            
-        else:
-            sec = "1"
-            
-        data_file = f"eleDef{sec}.txt"
-        if data_file in strain_data:
-            strains = strain_data[data_file]
+        s = elem_section(model, ele, int(sec)-1)
+        if s is not None:
+            fibers = np.concatenate([fiber_index(model, s, regions[ds]) for ds in dsr])
+            coords = section_coords(model, s)[fibers]
         else:
-            strains = strain_data[data_file] = read_sect_xml(a+f"/{data_file}")
-
-        X,Y,epsRaw = zip(*(
-                (
-                    fib["coord"][0], fib["coord"][1],
-                    fiber_strain(strains, e["name"], s, fib)
-                ) for ds in dsr
-            for e,s,fib in iter_elem_fibers(model, [ele], [int(sec)-1], filt=regions[ds])
-        ))
-        eps = np.array([e.T for e in epsRaw])
-        epsElei = X, Y, eps, intFrames, np.arange(eps.shape[1])
+            coords = np.empty((0, 2))
+        X, Y = coords.T
+        eps = section_strains(coords, section_deformations(strains, ele, sec))
+        epsElei = X, Y, eps, intFrames, window_steps(window, eps.shape[1])
         epsEle.append(epsElei)
     return epsEle
 
+def element_DS(eps, rows, dsrs=DSRS, thresholds=THRESHOLDS):
+    """
+    Evaluate every damage state in `dsrs` for one element from the strains
+    `eps` of its distinct fibers (see element_fibers). Regions with the
+    same fibers share a single pass over the strains.
+
+    Return the first step of each damage state (-1 if it does not occur)
+    and the rows of the fibers that reach it at that step.
+    """
+    first  = np.full(len(dsrs), -1)
+    fibers = [np.empty(0, dtype=int) for _ in dsrs]
+    groups = {}
+    for i, ds in enumerate(dsrs):
+        groups.setdefault(rows[ds].tobytes(), []).append(i)
+
+    for group in groups.values():
+        r = rows[dsrs[group[0]]]
+        sub = eps if len(r) == len(eps) else eps[r]
+        steps, hits = first_exceedance(sub, [thresholds[i] for i in group])
+        for i, t, hit in zip(group, steps, hits):
+            first[i], fibers[i] = t, r[hit]
+    return first, fibers
+
+def fiber_files(dataDir, dsr, sec="1"):
+    """
+    Find the fiber recorder files <ds>_<sec>_<x>_<y>.txt (possibly compressed)
+    of the regions in dsr with a single listing of dataDir, and return
+    their names and coordinates.
+    """
+    listing = sorted(os.listdir(dataDir))
+    files, X, Y = [], [], []
+    for ds in dsr:
+        startSeq = ds + "_" + sec + "_"
+        for file in listing:
+            if file.startswith(startSeq) and ".txt" in file:
+                x, y = file[len(startSeq):file.rindex(".txt")].split("_", 1)
+                files.append(file)
+                X.append(float(x))
+                Y.append(float(y))
+    return files, np.array(X), np.array(Y)
+
+def _read_fiber_file(filename, col=2)->np.ndarray:
+    with open_recorder(filename) as f:
+        text = f.read()
+    ncols = len(text[:text.index(b"\n")].split())
+    return np.fromstring(text, sep=" ").reshape(-1, ncols)[:, col]
+
+def load_fiber_files(dataDir, files, threads=8)->np.ndarray:
+    "Read the strain column of each fiber file into an (nfib, nsteps) array."
+    first = _read_fiber_file(os.path.join(dataDir, files[0]))
+    eps = np.empty((len(files), len(first)))
+    eps[0] = first
+
+    def load(i):
+        eps[i] = _read_fiber_file(os.path.join(dataDir, files[i]))
+
+    with ThreadPoolExecutor(threads) as pool:
+        # list() re-raises any error from the workers
+        list(pool.map(load, range(1, len(files))))
+    return eps
+
 def getStrains(a, dsr):
     dataDir = os.getcwd() + "/" + a + "/"
     if "po" in a:
         intFrames = 1
     if "cyclic" in a:
         intFrames = 1
-    X = []; Y = []; files = []; epsRaw = []
     sec = "1"
-    for ds in dsr:
-        startSeq = ds + "_" + sec + "_"
-        for file in os.listdir(dataDir):
-            if file.startswith(startSeq):
-                files.append(file)
-                x = re.search(startSeq+'(.+?)_', file).group(1)
-                y = re.search('([e\d.-]+?).txt', file).group(1)
-                X.append(float(x))
-                Y.append(float(y))
-                epsRaw.append(np.loadtxt(dataDir+"\\"+file)[:, 2])
+    files, X, Y = fiber_files(dataDir, dsr, sec)
 
     if len(X) == 0:
         print("no fibers to plot! check DS definition and/or dsr option")
         sys.exit()
     else:
-        eps = np.zeros([len(X), len(epsRaw[0])])
-        for i in range(len(X)):
-            eps[i, :] = epsRaw[i].T
+        eps = load_fiber_files(dataDir, files)
         times = np.arange(eps.shape[1])
         return X, Y, eps, intFrames, times
 
@@ -220,51 +476,60 @@ def getStrains(a, dsr):
 #             # plt.show()
 #             return timeUlt, list(coordsUltFibers5).append(list(coordsUltFibers6)), list(epsUltFibers5).append(list(epsUltFibers6))
 
-def get_DS(a, model, elems, strain_data):
-    dsrs = ["dsr6", "dsr5", "dsr4", "dsr3", "dsr2", "dsr1", "dsr0"]
-    thresholds = [0.09, -0.011, -0.005, -0.005, -0.005, 0.002, 1.32e-4]
+def get_DS(a, model, elems, strain_data, window=None):
+    dsrs = DSRS
+    thresholds = THRESHOLDS
     # if not os.path.exists(a+"/DSsummaries"):
     #     os.makedirs(a+"/DSsummaries")
     # Get timepoints at which each strain-based damage state occurs.
 
     timeDS = np.zeros((len(dsrs), len(elems)))
-    for i in range(len(dsrs)):  # For each DS / corresponding section region
-        dsr = dsrs[i]
-        th = thresholds[i]
-        epsEle = getDamageStateStrains(a, [dsr], model, elems, strain_data)
-        for j in range(len(elems)):   # For each element
-            X, Y, eps = epsEle[j][:3]
-            for t in range(eps.shape[1]):
-                epst = eps[:, t]
-                if (th < 0 and any(epst <= th)) or (th > 0 and any(epst >= th)):
-                    timeDS[i, j] = t
-                    break
-                    # print("For element " + str(elems[j]) + ", DS", 6-i, " occurs at timepoint ", t, ".")
-                    # iDSFibers = [i for i in range(len(X)) if (0 > th >= epst[i]) or (0 < th <= epst[i])]
-                    # XDSFibers = np.array(X)[iDSFibers]
-                    # YDSFibers = np.array(Y)[iDSFibers]
-                    # coordsDSFibers = np.column_stack((XDSFibers, YDSFibers))
-                    # epsDSFibers = epst[iDSFibers]
-                    # DSsummary = pd.DataFrame(np.column_stack((coordsDSFibers, epsDSFibers, [t] * len(coordsDSFibers))),
+    for j, ele in enumerate(elems):   # For each element
+        # strains of each distinct fiber are computed once and shared by
+        # all of the damage state regions that contain it
+        coords, rows = element_fibers(model, ele, dsrs)
+        strains = element_strains(a, ele, elems, strain_data, window or {})
+        with stage("strains"):
+            eps = section_strains(coords, section_deformations(strains, ele, damage_section(ele)))
+        steps = window_steps(window, eps.shape[1])
+        X, Y = coords.T
+
+        with stage("thresholds"):
+            first, fibers = element_DS(eps, rows, dsrs, thresholds)
+        for i in np.flatnonzero(first >= 0):
+            t, iDSFibers = first[i], fibers[i]
+            timeDS[i, j] = steps[t]
+                # print("For element " + str(elems[j]) + ", DS", 6-i, " occurs at timepoint ", t, ".")
+                # XDSFibers = np.array(X)[iDSFibers]
+                # YDSFibers = np.array(Y)[iDSFibers]
+                # coordsDSFibers = np.column_stack((XDSFibers, YDSFibers))
+                # epsDSFibers = eps[iDSFibers, t]
+                # DSsummary = pd.DataFrame(np.column_stack((coordsDSFibers, epsDSFibers, [t] * len(coordsDSFibers))),
                                             #    columns=["Fiber X Coord", "Fiber Y Coord", "Strain", "Timepoint"])
-                    # DSsummary.to_csv(a+"/DSsummaries/"+str(elems[j])+"DS"+str(6-i)+"Summary.csv", index=False)
-                    # print("For element " + str(elems[j]) + ", the coordinates and corresponding strains of failed fibers at DS", 6-i, " are:")
-                    # print(DSsummary)
-                    # plt.figure(figsize=(5, 4))
-                    # plt.scatter(X, Y, c=epst, vmin=-0.01, vmax=0.01)
-                    # plt.colorbar(label="strain")
-                    # plt.scatter(XDSFibers, YDSFibers, marker='x', color="r", label="Failed Fibers at DS"+str(6-i))
-                    # plt.xlabel("Section Horizontal (X) Axis [inches]")
-                    # plt.ylabel("Section Vertical (Y) Axis [inches]")
-                    # plt.title("Element " + str(elems[j]) + ", strains at point of DS"+str(6-i)+" (timepoint " + str(t) + ")")
-                    # plt.tight_layout()
-                    # plt.grid()
-                    # plt.xlim([-50, 50])
-                    # plt.ylim([-50, 50])
-                    # plt.legend()
-                    # plt.gcf().savefig(a+"/DSsummaries/"+str(elems[j])+"DS"+str(6-i)+".png")
-                    # # plt.show()
+                # DSsummary.to_csv(a+"/DSsummaries/"+str(elems[j])+"DS"+str(6-i)+"Summary.csv", index=False)
+                # print("For element " + str(elems[j]) + ", the coordinates and corresponding strains of failed fibers at DS", 6-i, " are:")
+                # print(DSsummary)
+                # plt.figure(figsize=(5, 4))
+                # plt.scatter(X, Y, c=eps[:, t], vmin=-0.01, vmax=0.01)
+                # plt.colorbar(label="strain")
+                # plt.scatter(XDSFibers, YDSFibers, marker='x', color="r", label="Failed Fibers at DS"+str(6-i))
+                # plt.xlabel("Section Horizontal (X) Axis [inches]")
+                # plt.ylabel("Section Vertical (Y) Axis [inches]")
+                # plt.title("Element " + str(elems[j]) + ", strains at point of DS"+str(6-i)+" (timepoint " + str(t) + ")")
+                # plt.tight_layout()
+                # plt.grid()
+                # plt.xlim([-50, 50])
+                # plt.ylim([-50, 50])
+                # plt.legend()
+                # plt.gcf().savefig(a+"/DSsummaries/"+str(elems[j])+"DS"+str(6-i)+".png")
+                # # plt.show()
     # print("timeDS", timeDS)
+    with stage("write"):
+        maxDSele, timeMaxDSele = write_DS(a, elems, timeDS)
+    return maxDSele, timeMaxDSele, timeDS
+
+def write_DS(a, elems, timeDS):
+    "Write the most severe damage state of each element to DamageStatesByElement.csv"
     timeMaxDSele = np.amax(timeDS, axis=0)
     maxDSele = np.array([6,5,4,3,2,1,0])[np.argmax(timeDS, axis=0)]
     for i in range(len(maxDSele)):
@@ -275,8 +540,354 @@ def get_DS(a, model, elems, strain_data):
     # print("maxDSele", maxDSele)
     DSbyEle = pd.DataFrame(np.column_stack((elems, maxDSele, timeMaxDSele)), columns=["Element", "DS", "Timepoint of DS"])
     DSbyEle.to_csv(a+"/DamageStatesByElement.csv", index=False)
+    return maxDSele, timeMaxDSele
+
+def _file_state(filename):
+    "Size and mtime of filename, or None if it does not exist yet."
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def follow_DS(a, model, elems, interval=1.0, timeout=600.0):
+    """
+    Evaluate damage states while OpenSees is still writing the eleDef
+    recorders in `a`, printing each first exceedance as soon as the rows
+    that contain it are written. The final result is written like get_DS.
+    Raises TimeoutError if no recorder changes for `timeout` seconds
+    before all of them are closed.
+    """
+    readers = {
+        f"eleDef{sec}.txt": FollowReader(a+f"/eleDef{sec}.txt", elements=elems,
+                                         responses=STRAIN_RESPONSES)
+        for sec in {damage_section(ele) for ele in elems}
+    }
+    timeDS = np.zeros((len(DSRS), len(elems)))
+    found = np.zeros(timeDS.shape, dtype=bool)
+    states = {}
+    active = time.monotonic()
+    while not all(reader.done for reader in readers.values()):
+        current = {data_file: _file_state(reader.filename) for data_file, reader in readers.items()}
+        if current != states:
+            states, active = current, time.monotonic()
+        elif time.monotonic() - active > timeout:
+            waiting = [data_file for data_file, reader in readers.items() if not reader.done]
+            raise TimeoutError(f"{', '.join(waiting)} in {a} unchanged for {timeout:g} s "
+                               "without a closing </Data> tag; did the analysis stop?")
+        new = False
+        for data_file, reader in readers.items():
+            t0 = reader.nrows
+            if (strains := reader.poll()) is None:
+                continue
+            new = True
+            jj = [j for j, ele in enumerate(elems) if f"eleDef{damage_section(ele)}.txt" == data_file]
+            for j in jj:
+                if found[:, j].all():
+                    continue
+                ele = elems[j]
+                coords, rows = element_fibers(model, ele, DSRS)
+                eps = section_strains(coords, section_deformations(strains, ele, damage_section(ele)))
+                steps = window_steps({"t0": t0}, eps.shape[1])
+                first, _ = element_DS(eps, rows)
+                for i in np.flatnonzero((first >= 0) & ~found[:, j]):
+                    found[i, j] = True
+                    timeDS[i, j] = steps[first[i]]
+                    print("For element " + str(ele) + ", DS", 6-i, " occurs at timepoint ", steps[first[i]], ".")
+        if not new:
+            time.sleep(interval)
+
+    maxDSele, timeMaxDSele = write_DS(a, elems, timeDS)
     return maxDSele, timeMaxDSele, timeDS
 
+class StrainEnvelope:
+    """
+    Running peak statistics of the strain histories of nfib fibers, which
+    are fed to update() one (nfib, nsteps) chunk of steps at a time.
+    """
+    def __init__(self, nfib):
+        self.nsteps = 0
+        self.max  = np.full(nfib, -np.inf)
+        self.tmax = np.zeros(nfib, dtype=int)
+        self.min  = np.full(nfib,  np.inf)
+        self.tmin = np.zeros(nfib, dtype=int)
+        # number of times the strain changes direction, and total strain travelled
+        self.reversals = np.zeros(nfib, dtype=int)
+        self.travel = np.zeros(nfib)
+        self._last  = None                  # strain at the last step seen
+        self._slope = np.zeros(nfib)        # sign of the last nonzero increment
+
+    def update(self, eps):
+        nfib, n = eps.shape
+        if n == 0:
+            return
+        fibers = np.arange(nfib)
+        for peak, step, arg, better in [(self.max, self.tmax, np.argmax, np.greater),
+                                        (self.min, self.tmin, np.argmin, np.less)]:
+            i = arg(eps, axis=1)
+            value = eps[fibers, i]
+            new = better(value, peak)
+            peak[new] = value[new]
+            step[new] = self.nsteps + i[new]
+
+        d = np.diff(eps, axis=1, prepend=eps[:, :1] if self._last is None else self._last[:, None])
+        self.travel += np.abs(d).sum(axis=1)
+        # carry the sign of the last nonzero increment over zero increments
+        sign = np.column_stack((self._slope, np.sign(d)))
+        last = np.where(sign != 0, np.arange(n + 1), 0)
+        np.maximum.accumulate(last, axis=1, out=last)
+        sign = sign[fibers[:, None], last]
+        self.reversals += (sign[:, 1:] * sign[:, :-1] < 0).sum(axis=1)
+
+        self._slope = sign[:, -1]
+        self._last = eps[:, -1].copy()
+        self.nsteps += n
+
+def strain_envelopes(a, model, elems, dsrs=DSRS)->pd.DataFrame:
+    """
+    Compute the StrainEnvelope of every fiber of elems in the damage state
+    regions dsrs while streaming the eleDef recorders of `a`, so that only
+    one chunk of strain histories is held at a time. Return one row per
+    fiber, with a column per region marking the fibers it contains.
+    """
+    fibers = {ele: element_fibers(model, ele, dsrs) for ele in elems}
+    envelopes = {ele: StrainEnvelope(len(fibers[ele][0])) for ele in elems}
+    for sec in sorted({damage_section(ele) for ele in elems}):
+        group = [ele for ele in elems if damage_section(ele) == sec]
+        chunks = iter_sect_xml4(find_recorder(a+f"/eleDef{sec}.txt"), elements=group,
+                                responses=STRAIN_RESPONSES)
+        while True:
+            with stage("read_recorder"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with stage("envelope"):
+                for ele in group:
+                    envelopes[ele].update(section_strains(fibers[ele][0], section_deformations(chunk, ele, sec)))
+
+    tables = []
+    for ele in elems:
+        (coords, rows), env = fibers[ele], envelopes[ele]
+        table = pd.DataFrame({
+            "Element": ele, "X": coords[:,0], "Y": coords[:,1],
+            "Max strain": env.max, "Step of max": env.tmax,
+            "Min strain": env.min, "Step of min": env.tmin,
+            "Reversals": env.reversals, "Strain travel": env.travel,
+        })
+        for ds in dsrs:
+            table[ds] = np.isin(np.arange(len(coords)), rows[ds])
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+def read_strain_data(a, elems, cache=True, window=None)->dict:
+    "Read the eleDef recorders in `a` that hold the damage sections of elems."
+    # eleDef files may also be compressed (.gz, .zst, .xz)
+    with stage("read_recorder"):
+        return {
+            data_file: read_sect_xml(find_recorder(a+f"/{data_file}"),
+                                     elements=elems, responses=STRAIN_RESPONSES,
+                                     cache=cache, **(window or {}))
+            for data_file in {f"eleDef{damage_section(ele)}.txt" for ele in elems}
+        }
+
+# Each DamageStatesByElement.csv is accompanied by a manifest of what it
+# was computed from, so that batch runs only redo GMs that changed.
+MANIFEST = "DamageStatesByElement.manifest.json"
+
+def file_hash(filename)->str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as f:
+        while chunk := f.read(1<<24):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def ds_params(model, elems, window=None)->dict:
+    "Everything other than the recorders that DamageStatesByElement.csv depends on."
+    return {
+        "model": model.get("hash"),
+        "diameters": list(DIAMETERS),
+        "dsrs": list(DSRS),
+        "thresholds": list(THRESHOLDS),
+        # keys of the damage state regions, with a digest of their definition
+        "regions": [damage_states(d)[ds]["key"] for d in DIAMETERS for ds in DSRS],
+        "elems": [int(ele) for ele in elems],
+        "window": window or {},
+    }
+
+def _input_files(a, elems)->list:
+    return [find_recorder(a+f"/eleDef{sec}.txt") for sec in sorted({damage_section(ele) for ele in elems})]
+
+def write_manifest(a, params):
+    "Record the inputs and parameters of the DamageStatesByElement.csv in `a`."
+    inputs = {}
+    for path in _input_files(a, params["elems"]):
+        stat = os.stat(path)
+        inputs[path.name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(path)}
+    tmp = os.path.join(a, f".{MANIFEST}.{os.getpid()}")
+    with open(tmp, "w") as f:
+        json.dump({"inputs": inputs, "params": params}, f, indent=2)
+    os.replace(tmp, os.path.join(a, MANIFEST))
+
+def stale_reason(a, params):
+    """
+    Return why the damage states in `a` must be (re)computed for `params`,
+    or None if DamageStatesByElement.csv is up to date. Input files are only
+    hashed when their size or mtime differs from the manifest.
+    """
+    try:
+        with open(os.path.join(a, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return "no manifest"
+    if not os.path.exists(os.path.join(a, "DamageStatesByElement.csv")):
+        return "output missing"
+    if manifest.get("params") != json.loads(json.dumps(params)):
+        changed = [k for k in params if manifest.get("params", {}).get(k) != params[k]]
+        return "changed " + ",".join(changed or ["params"])
+    try:
+        paths = _input_files(a, params["elems"])
+    except FileNotFoundError:
+        return "inputs missing"
+    if {p.name for p in paths} != set(manifest["inputs"]):
+        return "inputs renamed"
+    for path in paths:
+        saved = manifest["inputs"][path.name]
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) != (saved["size"], saved["mtime"]) \
+                and file_hash(path) != saved["hash"]:
+            return f"changed {path.name}"
+    return None
+
+def _init_batch(model):
+    global MODEL, REGIONS1, REGIONS2, REGIONS3
+    MODEL = model
+    REGIONS1, REGIONS2, REGIONS3 = (damage_states(d) for d in DIAMETERS)
+
+def damage_GM(a, elems, cache=True, window=None, profile=False):
+    "Evaluate the damage states of GM directory `a` in a batch worker."
+    if profile:
+        profiler.enable(memory=profile == "memory")
+    start = time.perf_counter()
+    try:
+        ds = get_DS(a, MODEL, elems, read_strain_data(a, elems, cache, window), window)
+        write_manifest(a, ds_params(MODEL, elems, window))
+        error = None
+    except Exception as e:
+        ds, error = None, f"{type(e).__name__}: {e}"
+    report = None
+    if profile:
+        report = profiler.report()
+        profiler.disable()
+        if error is None:
+            profiler.write_report(a+"/profile.json", report)
+    return a, time.perf_counter() - start, error, ds, report
+
+# Number of GMs per chunk written to a dsStore by batch_DS
+STORE_CHUNK = 64
+
+def store_DS(store, results, elems):
+    "Add the (gm, (maxDSele, timeMaxDSele, timeDS)) pairs in `results` to a dsStore."
+    if results:
+        gms, ds = zip(*results)
+        maxDS, timeMaxDS, timeDS = zip(*ds)
+        dsStore.write_chunk(store, [os.path.normpath(a) for a in gms], elems,
+                            maxDS, timeMaxDS, timeDS, DSRS)
+
+def _natural_key(name):
+    return [int(c) if c.isdigit() else c for c in re.split(r"(\d+)", name)]
+
+def batch_DS(pattern, elems, jobs=None, model_file=None, cache=True, window=None,
+             force=False, dry_run=False, store=None, profile=False, lazy=False)->dict:
+    """
+    Evaluate damage states for every GM directory matching `pattern` with
+    `jobs` worker processes. The model and fiber index are loaded once and
+    shared with the workers. A GM that fails is reported and skipped, and
+    unless `force` is set, GMs that are up to date are skipped as well.
+    With `dry_run`, only list the GMs that would be evaluated. Results are
+    also added to the dsStore `store` when it is given, in chunks of
+    STORE_CHUNK GMs. With `profile`, each GM gets a profile.json and a
+    summary of all of them is written to profile_summary.json; with
+    profile="memory" the peak memory of each stage is traced as well.
+
+    Return a dict mapping each directory to its time and error (None if
+    it succeeded).
+    """
+    dirs = sorted((d for d in glob.glob(pattern) if os.path.isdir(d)), key=_natural_key)
+    if not dirs:
+        print(f"No directories match {pattern}", file=sys.stderr)
+        return {}
+
+    if model_file is None:
+        model_file = os.path.join(dirs[0], "modelDetails.json")
+    if profile:
+        profiler.enable(memory=profile == "memory")
+    model = read_model(model_file, cache, elems if lazy else None)
+    indexed = load_fiber_index(model, index_file(model_file))
+    _init_batch(model)
+    # build the fiber index here so that workers inherit it
+    for ele in elems:
+        element_fibers(model, ele, DSRS)
+    if len(model.get("fiber_index", ())) > indexed:
+        save_fiber_index(model, index_file(model_file))
+
+    params = ds_params(model, elems, window)
+    todo = {a: "forced" if force else stale_reason(a, params) for a in dirs}
+    if store is not None and not force:
+        stored = dsStore.read_gms(store) if os.path.isdir(store) else set()
+        for a in dirs:
+            if todo[a] is None and os.path.normpath(a) not in stored:
+                todo[a] = "not in store"
+    todo = {a: reason for a, reason in todo.items() if reason is not None}
+    if dry_run:
+        for a, reason in todo.items():
+            print(f"{a}\t{reason}")
+        print(f"{len(todo)} of {len(dirs)} GMs would be evaluated", file=sys.stderr)
+        return {}
+    if len(todo) < len(dirs):
+        print(f"Skipping {len(dirs) - len(todo)} GMs that are up to date", file=sys.stderr)
+    if profile:
+        setup = profiler.report()
+        profiler.disable()
+
+    results, pending, reports = {}, [], []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(jobs, initializer=_init_batch, initargs=(model,)) as pool:
+        futures = {pool.submit(damage_GM, a, elems, cache, window, profile): a for a in todo}
+        try:
+            for future in as_completed(futures):
+                try:
+                    a, elapsed, error, ds, report = future.result()
+                except Exception as e:
+                    a, elapsed, error, ds, report = futures[future], float("nan"), f"{type(e).__name__}: {e}", None, None
+                if report is not None and error is None:
+                    reports.append(report)
+                results[a] = {"time": elapsed, "error": error}
+                if error is None:
+                    print(f"{a}: {elapsed:.2f} s", file=sys.stderr)
+                else:
+                    print(f"{a}: FAILED after {elapsed:.2f} s: {error}", file=sys.stderr)
+
+                if store is not None and ds is not None:
+                    pending.append((a, ds))
+                    if len(pending) >= STORE_CHUNK:
+                        store_DS(store, pending, elems)
+                        pending = []
+        finally:
+            if store is not None:
+                store_DS(store, pending, elems)
+
+    failed = [a for a, r in results.items() if r["error"] is not None]
+    print(f"{len(todo) - len(failed)} of {len(todo)} GMs in {time.perf_counter() - start:.1f} s",
+          file=sys.stderr)
+    if profile:
+        summary = profiler.summarize(reports)
+        summary["setup"] = setup
+        summary["wall_time"] = time.perf_counter() - start
+        profiler.write_report("profile_summary.json", summary)
+    if failed:
+        print("Failed:", " ".join(sorted(failed, key=_natural_key)), file=sys.stderr)
+    return {a: results[a] for a in todo}
+
 # def getPushover(a, timeYield, timeUlt, timeDS):
 #     if "po" not in a:
 #         return None
@@ -395,9 +1006,30 @@ def get_DS(a, model, elems, strain_data):
 #     # writergif = animation.PillowWriter(fps=60)
 #     # anim.save(str(ele)+"fiberStrainAnimation.gif", writer=writergif)
 
-def read_model(filename:str)->dict:
-    with open(filename, "r") as f:
-        model = json.load(f)
+def read_model(filename:str, compiled=True, elements=None)->dict:
+    """
+    Read modelDetails.json. With `compiled`, the model is loaded from its
+    compiled form (see modelCache), which is written on first use and
+    rewritten whenever the hash of the JSON changes. If `elements` is given,
+    only those elements and the sections and materials they reference are
+    decoded (see lazyModel).
+    """
+    with stage("read_model"):
+        if elements is not None:
+            return lazyModel.read_model(filename, elements)
+        with open(filename, "rb") as f:
+            raw = f.read()
+        digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+        if compiled and (model := modelCache.load_model(filename, digest)) is not None:
+            return model
+        model = _read_model(raw)
+        model["hash"] = digest
+        if compiled:
+            modelCache.compile_model(model, filename)
+        return model
+
+def _read_model(raw)->dict:
+    model = json.loads(raw)
     sam = model["StructuralAnalysisModel"]
     model["sections"] = {
         str(s["name"]): s for s in sam["properties"]["sections"]
@@ -416,18 +1048,29 @@ if __name__ == "__main__":
 
     opts = parse_args(sys.argv[1:])
 
-    print("GM:", opts["a"], file=sys.stderr)
-
-    model = read_model(opts["a"]+"/modelDetails.json")
-
-
     if opts["dsr"] == ["7ds"]:
         opts["dsr"] = ["dsr0","dsr1","dsr2","dsr3","dsr4","dsr5","dsr6"]
 
     if opts["elems"] is None:
         opts["elems"] = [4010]
     if opts["elems"] == ["all"]:
-        opts["elems"] = [2010, 2020, 3010, 3020, 4010, 4020, 5010, 5020, 6010, 6020, 7010, 7020, 8010, 8020, 9010, 9020, 10010, 10020, 11010, 11020, 12010, 12020, 12030, 13010, 13020, 14010, 14020, 14030]
+        opts["elems"] = list(COLUMNS)
+
+    if opts["batch"] is not None:
+        results = batch_DS(opts["batch"], opts["elems"], opts["jobs"], opts["model"],
+                           opts["cache"], opts["window"], opts["force"], opts["dry_run"],
+                           opts["store"], opts["profile"], opts["lazy"])
+        sys.exit(any(r["error"] is not None for r in results.values()))
+
+    print("GM:", opts["a"], file=sys.stderr)
+
+    if opts["profile"]:
+        profiler.enable(memory=opts["profile"] == "memory")
+
+    model_file = opts["a"]+"/modelDetails.json"
+    model = read_model(model_file, opts["cache"], opts["elems"] if opts["lazy"] else None)
+    # fiber-to-region membership, computed once per model
+    indexed = load_fiber_index(model, index_file(model_file))
 
     if "po" in opts["a"]:
         if opts["vminset"] is None:
@@ -451,18 +1094,36 @@ if __name__ == "__main__":
     #     X, Y, eps, intFrames, times = getStrains(opts["a"], opts["dsr"])
     #     animate_heat_map(X, Y, eps, intFrames, vminset, vmaxset, 4010)
 
-    REGIONS1 = damage_states(84.0)
-    REGIONS2 = damage_states(66.0)
-    REGIONS3 = damage_states(48.0)
+    REGIONS1, REGIONS2, REGIONS3 = (damage_states(d) for d in DIAMETERS)
 
-    strain_data = {
-        file.name: read_sect_xml(file) for file in Path(opts["a"]).glob("eleDef*.txt")
-    }
+    if opts["follow"]:
+        try:
+            follow_DS(opts["a"], model, opts["elems"], opts["interval"], opts["timeout"])
+        except TimeoutError as e:
+            sys.exit(str(e))
+        sys.exit()
+
+    if opts["envelope"]:
+        strain_envelopes(opts["a"], model, opts["elems"]).to_csv(opts["a"]+"/StrainEnvelopes.csv", index=False)
+        if opts["profile"]:
+            profiler.write_report(opts["a"]+"/profile.json")
+        sys.exit()
+
+    strain_data = read_strain_data(opts["a"], opts["elems"], opts["cache"], opts["window"])
 
     if np.all(np.isin(["dsr1", "dsr2", "dsr3", "dsr4", "dsr5", "dsr6"], opts["dsr"])):
 
         # print("Calculating Strain-Based Damage States...", file=sys.stderr)
-        dsr, timeMaxDSele, timeDS = get_DS(opts["a"], model, opts["elems"], strain_data)
+        dsr, timeMaxDSele, timeDS = get_DS(opts["a"], model, opts["elems"], strain_data, opts["window"])
+        write_manifest(opts["a"], ds_params(model, opts["elems"], opts["window"]))
+        if opts["store"] is not None:
+            store_DS(opts["store"], [(opts["a"], (dsr, timeMaxDSele, timeDS))], opts["elems"])
+
+    if len(model.get("fiber_index", ())) > indexed:
+        save_fiber_index(model, index_file(model_file))
+
+    if opts["profile"]:
+        profiler.write_report(opts["a"]+"/profile.json")
 
     # if np.isin("dsr6", opts["dsr"]) and np.isin("dsr5", opts["dsr"]) and 'po' in opts["a"]:
     #     # NEEDS FIXING
@@ -1,21 +1,147 @@
+#!/usr/bin/env python
+"""
+Summarize the strain-based damage states of a suite of GMs.
+
+    python globalSBDS.py [options]
+
+Options
+-g <glob>       GM directories (default GM*)
+-j <int>        threads used to read DamageStatesByElement.csv files (default 16)
+-o <file>       output file (default SB_DS_global.csv)
+-store <dir>    read a store written by fiberStrains.py -store (e.g.
+                DamageStates.store) instead of the per-GM csv files
+-full           recompute every GM instead of only those that are new or
+                changed since the output was last written
+
+The output has one row per GM with the DS of each element, the global
+(maximum) DS, the fraction of damaged elements, and the number of
+elements in each DS.
+"""
+import os, re, sys, glob
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 
-num_GM = 755
-
-# Get Strain-Based Damage States By Element and Extract maxGlobal and pctGlobal DS
-sbPoint = [None] * num_GM
-sbInfo1 = pd.read_csv("GM1/DamageStatesByElement.csv")
-elemList = sbInfo1["Element"].astype(int).tolist()
-sbDS = np.empty([num_GM, len(elemList)+2])
-for i in range(num_GM):
-    # Get strain-based DS values
-    sbFile = "GM" + str(i+1) + "/DamageStatesByElement.csv"
-    sbInfo = pd.read_csv(sbFile)
-    eleSBDS = sbInfo["DS"].astype(int).tolist()    
-    maxGlobal = [max(eleSBDS)]
-    pctGlobal = [len(sbInfo[sbInfo["DS"] > 0]) / len(elemList)]
-    sbDS[i] = eleSBDS+maxGlobal+pctGlobal
-    
-SB_DS_Summary = pd.DataFrame(np.column_stack((np.arange(1,num_GM+1), sbDS)), columns=["GM"]+elemList+["global (max)", "global (%)"])
-SB_DS_Summary.to_csv("SB_DS_global.csv", index=False)
\ No newline at end of file
+NDS = 7
+
+def gm_number(name):
+    "The number at the end of a GM directory name, or None if it has none."
+    match = re.search(r"(\d+)$", os.path.normpath(name))
+    return None if match is None else int(match.group(1))
+
+def numbered(names)->list:
+    "The names that end in a GM number, warning about the others."
+    names = list(names)
+    for name in names:
+        if gm_number(name) is None:
+            print(f"Skipping {name}: no GM number at the end of its name", file=sys.stderr)
+    return [name for name in names if gm_number(name) is not None]
+
+def read_gm(a):
+    "Return the elements and damage states in the DamageStatesByElement.csv of `a`."
+    sbInfo = pd.read_csv(os.path.join(a, "DamageStatesByElement.csv"), usecols=["Element", "DS"])
+    return sbInfo["Element"].to_numpy(dtype=int), sbInfo["DS"].to_numpy(dtype=int)
+
+def read_gms(dirs, threads=16):
+    "Read the damage states of every directory in dirs into a (ngm, nele) array."
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(read_gm, dirs))
+    elems = results[0][0]
+    for a, (e, _) in zip(dirs, results):
+        if not np.array_equal(e, elems):
+            raise ValueError(f"Elements of {a} differ from those of {dirs[0]}")
+    return elems, np.array([ds for _, ds in results]).reshape(len(dirs), len(elems))
+
+def summarize(gms, elems, sbDS)->pd.DataFrame:
+    "Global max DS, fraction of damaged elements and per-DS counts of each GM."
+    maxGlobal = sbDS.max(axis=1)
+    pctGlobal = (sbDS > 0).sum(axis=1) / len(elems)
+    counts = (sbDS[:, :, None] == np.arange(NDS)).sum(axis=1)
+    return pd.DataFrame(
+        np.column_stack((gms, sbDS, maxGlobal, pctGlobal, counts)),
+        columns=["GM"] + list(elems) + ["global (max)", "global (%)"]
+               + [f"DS{i} (count)" for i in range(NDS)]
+    )
+
+def _previous(output, elems, dirs):
+    "Rows of a previous output that are still valid for dirs."
+    try:
+        old = pd.read_csv(output)
+    except (OSError, ValueError):
+        return None
+    columns = ["GM"] + [str(e) for e in elems] + ["global (max)", "global (%)"] \
+            + [f"DS{i} (count)" for i in range(NDS)]
+    if list(old.columns) != columns:
+        return None
+    mtime = os.path.getmtime(output)
+    current = {
+        gm_number(a) for a in dirs
+        if os.path.getmtime(os.path.join(a, "DamageStatesByElement.csv")) < mtime
+    }
+    return old[old["GM"].astype(int).isin(current)]
+
+def parse_args(args)->dict:
+    opts = {
+        "glob": "GM*",
+        "threads": 16,
+        "output": "SB_DS_global.csv",
+        "store": None,
+        "full": False
+    }
+    argi = iter(args)
+    for arg in argi:
+        if arg in ["-h", "--help"]:
+            print(__doc__)
+            sys.exit()
+        elif arg == "-g":
+            opts["glob"] = next(argi)
+        elif arg == "-j":
+            opts["threads"] = int(next(argi))
+        elif arg == "-o":
+            opts["output"] = next(argi)
+        elif arg == "-store":
+            opts["store"] = next(argi)
+        elif arg == "-full":
+            opts["full"] = True
+    return opts
+
+
+if __name__ == "__main__":
+    opts = parse_args(sys.argv[1:])
+
+    if opts["store"] is not None:
+        from dsStore import read_store
+        store = read_store(opts["store"])
+        rows = np.isin(store["gm"], numbered(store["gm"]))
+        gms = np.array([gm_number(gm) for gm in store["gm"][rows]], dtype=int)
+        order = np.argsort(gms, kind="stable")
+        summary = summarize(gms[order], store["elems"], store["ds"][rows][order])
+        summary.to_csv(opts["output"], index=False)
+        sys.exit()
+
+    dirs = sorted(
+        numbered(a for a in glob.glob(opts["glob"])
+            if os.path.exists(os.path.join(a, "DamageStatesByElement.csv"))),
+        key=gm_number
+    )
+    if not dirs:
+        print(f"No DamageStatesByElement.csv found in {opts['glob']}", file=sys.stderr)
+        sys.exit(1)
+
+    elems, _ = read_gm(dirs[0])
+    old = None if opts["full"] else _previous(opts["output"], elems, dirs)
+    if old is not None:
+        done = set(old["GM"].astype(int))
+        dirs = [a for a in dirs if gm_number(a) not in done]
+        print(f"Reading {len(dirs)} new or changed GMs", file=sys.stderr)
+
+    if dirs:
+        elems, sbDS = read_gms(dirs, opts["threads"])
+        summary = summarize([gm_number(a) for a in dirs], elems, sbDS)
+        if old is not None:
+            summary.columns = old.columns
+            summary = pd.concat([old, summary])
+    else:
+        summary = old
+    summary = summary.sort_values("GM", kind="stable")
+    summary.to_csv(opts["output"], index=False)
@@ -0,0 +1,164 @@
+"""
+Selective loading of a modelDetails.json.
+
+The first time a model is read, its JSON is scanned once (without being
+decoded) for the byte range of every entry of the
+
+    StructuralAnalysisModel.geometry.elements
+    StructuralAnalysisModel.properties.sections
+    StructuralAnalysisModel.properties.uniaxialMaterials
+
+arrays, and these offsets are saved to modelDetails.offsets.json. After
+that, read_model decodes only the elements asked for and the sections and
+materials they reference, so its cost depends on the query and not on the
+size of the model.
+"""
+import os
+import re
+import json
+import mmap
+import hashlib
+
+SUFFIX = ".offsets.json"
+
+ARRAYS = {
+    ("StructuralAnalysisModel", "geometry", "elements"): "elements",
+    ("StructuralAnalysisModel", "properties", "sections"): "sections",
+    ("StructuralAnalysisModel", "properties", "uniaxialMaterials"): "materials",
+}
+
+_TOKEN = re.compile(rb'[{}\[\]"]')
+_NAME  = re.compile(rb'\s*\{\s*"name"\s*:\s*("(?:[^"\\]|\\.)*"|-?[0-9][0-9.eE+-]*)')
+_SPACE = b" \t\r\n"
+
+def _string_end(buf, pos)->int:
+    "Return the offset of the quote that closes the string starting at pos."
+    end = pos
+    while True:
+        end = buf.index(b'"', end)
+        k = end - 1
+        while buf[k] == 0x5c:  # backslash
+            k -= 1
+        if (end - 1 - k) % 2 == 0:
+            return end
+        end += 1
+
+def _entry_name(entry, kind)->str:
+    if (m := _NAME.match(entry)) is not None:
+        name = json.loads(m.group(1))
+    else:
+        name = json.loads(entry)["name"]
+    return str(int(name)) if kind == "elements" else str(name)
+
+def scan_model(buf)->dict:
+    """
+    Return the byte ranges of the entries of the arrays in ARRAYS, as
+    {"elements": {name: [start, end]}, "sections": ..., "materials": ...}.
+    Only the structure of the JSON is followed; nothing is decoded.
+    """
+    offsets = {kind: {} for kind in ARRAYS.values()}
+    stack = []      # key of each open container; None for array items
+    entry = None    # (kind, depth, start) of the entry being scanned
+    key = None
+    pos = 0
+    while (m := _TOKEN.search(buf, pos)) is not None:
+        c, pos = buf[m.start()], m.end()
+        if c == 0x22:  # string
+            end = _string_end(buf, pos)
+            j = end + 1
+            while buf[j] in _SPACE:
+                j += 1
+            if buf[j] == 0x3a:  # ':' follows, so this is a key
+                key = buf[pos:end].decode()
+            pos = end + 1
+
+        elif c == 0x7b or c == 0x5b:  # { [
+            if entry is None and c == 0x7b and tuple(stack[1:]) in ARRAYS:
+                entry = ARRAYS[tuple(stack[1:])], len(stack), m.start()
+            stack.append(key)
+            key = None
+
+        else:  # } ]
+            stack.pop()
+            if entry is not None and len(stack) == entry[1]:
+                kind, _, start = entry
+                offsets[kind][_entry_name(buf[start:pos], kind)] = [start, pos]
+                entry = None
+    return offsets
+
+
+def offsets_path(json_file)->str:
+    return os.path.splitext(json_file)[0] + SUFFIX
+
+def model_offsets(json_file)->dict:
+    """
+    Return the entry offsets of json_file, along with its size, mtime and
+    hash (the same hash read_model uses). They are read from the saved
+    offsets when the size and mtime of the file are unchanged.
+    """
+    stat = os.stat(json_file)
+    try:
+        with open(offsets_path(json_file)) as f:
+            index = json.load(f)
+        if (index["size"], index["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(json_file, "rb") as f:
+        buf = f.read()
+    index = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "hash": hashlib.blake2b(buf, digest_size=16).hexdigest(),
+        **scan_model(buf)
+    }
+    tmp = f"{offsets_path(json_file)}.tmp-{os.getpid()}"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, offsets_path(json_file))
+    except OSError:
+        pass
+    return index
+
+
+def read_model(json_file, elements, index=None)->dict:
+    """
+    Decode only `elements`, their sections (and the sections those
+    aggregate) and the materials these use. The result has the same
+    "sections", "materials", "elements" and "hash" entries as
+    fiberStrains.read_model, restricted to what was reached.
+    """
+    if index is None:
+        index = model_offsets(json_file)
+    model = {"hash": index["hash"], "elements": {}, "sections": {}, "materials": {}}
+    if os.path.getsize(json_file) == 0:
+        return model
+
+    with open(json_file, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        def load(kind, name):
+            if name not in model[kind]:
+                start, end = index[kind][name]
+                model[kind][name] = json.loads(mm[start:end])
+            return model[kind][name]
+
+        seen = set()
+        for tag in elements:
+            el = load("elements", str(int(tag)))
+            todo = list(el.get("sections", ()))
+            while todo:
+                name = str(todo.pop())
+                if name in seen:
+                    continue
+                seen.add(name)
+                s = load("sections", name)
+                if "section" in s:
+                    todo.append(s["section"])
+                for m in s.get("materials", ()):
+                    load("materials", str(m))
+                for m in {f["material"] for f in s.get("fibers", ())}:
+                    load("materials", str(m))
+    return model
@@ -0,0 +1,156 @@
+"""
+Compiled form of the sections, materials and elements of a modelDetails.json.
+
+The compiled model is a directory next to the JSON file,
+
+    modelDetails.compiled/
+        meta.json               hash of the JSON; names and types of
+                                materials, sections and elements
+        coords.npy      (nfib, 2)   fiber coordinates of all sections
+        area.npy        (nfib,)     fiber areas
+        material.npy    (nfib,)     int32 index of each fiber's material
+        fiber_ptr.npy   (nsec+1,)   fibers of section i are fiber_ptr[i]:fiber_ptr[i+1]
+        base.npy        (nsec,)     int32 section aggregated by section i, or -1
+        element_tags.npy    (nele,)
+        element_ptr.npy     (nele+1,)   sections of element j are
+        element_sections.npy            element_sections[element_ptr[j]:element_ptr[j+1]]
+
+The arrays are memory-mapped when the model is loaded, and the fibers of
+a section are presented as a FiberTable instead of a list of dicts.
+"""
+import os
+import json
+import shutil
+from collections.abc import Sequence
+
+import numpy as np
+
+SUFFIX = ".compiled"
+ARRAYS = ("coords", "area", "material", "fiber_ptr", "base",
+          "element_tags", "element_ptr", "element_sections")
+
+class FiberTable(Sequence):
+    """
+    Struct-of-arrays fibers of one section. The coord, area and material
+    arrays are used directly by the vectorized code; indexing returns the
+    {"coord", "area", "material"} dict of a single fiber, like the JSON.
+    """
+    __slots__ = ("coord", "area", "material", "materials")
+
+    def __init__(self, coord, area, material, materials):
+        self.coord = coord
+        self.area = area
+        self.material = material    # indices into materials
+        self.materials = materials  # material names
+
+    def __len__(self):
+        return len(self.area)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {
+            "coord": self.coord[i].tolist(),
+            "area": float(self.area[i]),
+            "material": self.materials[self.material[i]]
+        }
+
+
+def compiled_path(json_file)->str:
+    return os.path.splitext(json_file)[0] + SUFFIX
+
+
+def compile_model(model, json_file):
+    "Write the compiled form of a model read by fiberStrains.read_model; failures are ignored."
+    materials = list(model["materials"])
+    material_id = {name: i for i, name in enumerate(materials)}
+    sections = list(model["sections"])
+    section_id = {name: i for i, name in enumerate(sections)}
+    elements = list(model["elements"].values())
+
+    fibers = [f for s in model["sections"].values() for f in s.get("fibers", ())]
+    arrays = {
+        "coords":   np.array([f["coord"] for f in fibers], dtype=np.float64).reshape(-1, 2),
+        "area":     np.array([f["area"] for f in fibers], dtype=np.float64),
+        "material": np.array([material_id[f["material"]] for f in fibers], dtype=np.int32),
+        "fiber_ptr": np.cumsum([0] + [len(s.get("fibers", ())) for s in model["sections"].values()]),
+        "base":     np.array([section_id.get(s.get("section"), -1) for s in model["sections"].values()],
+                             dtype=np.int32),
+        "element_tags": np.array([int(el["name"]) for el in elements], dtype=np.int64),
+        "element_ptr":  np.cumsum([0] + [len(el.get("sections", ())) for el in elements]),
+        "element_sections": np.array([section_id[s] for el in elements for s in el.get("sections", ())],
+                                     dtype=np.int32),
+    }
+    meta = {
+        "hash": model["hash"],
+        "materials": materials,
+        "material_types": [model["materials"][m]["type"] for m in materials],
+        "sections": sections,
+        "section_types": [model["sections"][s]["type"] for s in sections],
+        "element_types": [el["type"] for el in elements],
+    }
+
+    target = compiled_path(json_file)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        # meta.json is written last; a directory without it is incomplete
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_model(json_file, digest):
+    """
+    Load the compiled form of json_file if it was compiled from a file with
+    hash `digest`; otherwise return None. The result has the "sections",
+    "materials" and "elements" dicts of read_model, with a FiberTable in
+    place of each section's fiber list.
+    """
+    path = compiled_path(json_file)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["hash"] != digest:
+            return None
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    materials = meta["materials"]
+    sections = meta["sections"]
+    ptr = arrays["fiber_ptr"]
+    model = {
+        "hash": digest,
+        "compiled": arrays,
+        "materials": {
+            name: {"name": name, "type": kind}
+            for name, kind in zip(materials, meta["material_types"])
+        },
+        "sections": {},
+        "elements": {},
+    }
+    for i, (name, kind) in enumerate(zip(sections, meta["section_types"])):
+        s = {"name": name, "type": kind}
+        if arrays["base"][i] >= 0:
+            s["section"] = sections[arrays["base"][i]]
+        if ptr[i+1] > ptr[i]:
+            s["fibers"] = FiberTable(arrays["coords"][ptr[i]:ptr[i+1]],
+                                     arrays["area"][ptr[i]:ptr[i+1]],
+                                     arrays["material"][ptr[i]:ptr[i+1]],
+                                     materials)
+        model["sections"][name] = s
+
+    eptr = arrays["element_ptr"]
+    for j, (tag, kind) in enumerate(zip(arrays["element_tags"].tolist(), meta["element_types"])):
+        el = {"name": tag, "type": kind}
+        if eptr[j+1] > eptr[j]:
+            el["sections"] = [sections[i] for i in arrays["element_sections"][eptr[j]:eptr[j+1]]]
+        model["elements"][str(tag)] = el
+    return model
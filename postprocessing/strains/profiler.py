@@ -0,0 +1,175 @@
+"""
+Wall time, call counts and peak memory of the stages of a computation.
+
+    import profiler
+    with profiler.profile() as prof:
+        with profiler.stage("parse"):
+            ...
+    print(prof.report())
+
+Stages are recorded only while profiling is enabled; otherwise entering
+a stage costs about as much as an empty function call. Stages may be
+nested, and a function can be marked as a stage with @profiler.profiled.
+With enable(memory=True) (or profile(memory=True)) stages also record
+their peak memory, the largest amount of memory traced by tracemalloc
+(which includes numpy arrays) above what was allocated when the stage
+began. Tracing hooks every allocation and slows the stages down, so
+their times are only meaningful in runs without it.
+
+Reports also hold the peak resident size of the process over its whole
+life (process_max_rss_kb), which in a pool worker covers every task it
+has run, and how much that peak grew since enable() (max_rss_growth_kb).
+"""
+import sys
+import json
+import time
+import resource
+import functools
+import tracemalloc
+
+ENABLED = False
+MEMORY  = False     # trace the peak memory of stages
+
+_stages = {}
+_stack  = []
+_start  = None
+_rss    = 0     # peak resident size when enabled
+
+class stage:
+    "Context manager that adds the time (and memory) of its block to stage `name`."
+    __slots__ = ("name", "start", "base", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if ENABLED:
+            if MEMORY:
+                self.base = tracemalloc.get_traced_memory()[0]
+                if _stack:
+                    # keep the peak of the enclosing stage before resetting it
+                    parent = _stack[-1]
+                    parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1] - parent.base)
+                tracemalloc.reset_peak()
+            self.peak = 0
+            _stack.append(self)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED and _stack and _stack[-1] is self:
+            elapsed = time.perf_counter() - self.start
+            _stack.pop()
+            record = _stages.setdefault(self.name, {"calls": 0, "time": 0.0})
+            record["calls"] += 1
+            record["time"]  += elapsed
+            if MEMORY:
+                peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.base)
+                record["peak_bytes"] = max(record.get("peak_bytes", 0), peak)
+                if _stack:
+                    parent = _stack[-1]
+                    parent.peak = max(parent.peak, peak + self.base - parent.base)
+        return False
+
+
+def profiled(name=None):
+    "Decorator that runs every call of a function as a stage."
+    def decorate(func):
+        label = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            if not ENABLED:
+                return func(*args, **kwds)
+            with stage(label):
+                return func(*args, **kwds)
+        return wrapper
+    return decorate
+
+
+def enable(memory=False):
+    "Start recording stages, discarding any recorded so far; with `memory`, trace their peak memory."
+    global ENABLED, MEMORY, _start, _rss
+    _stages.clear()
+    _stack.clear()
+    MEMORY = memory
+    if MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _start = time.perf_counter()
+    _rss = _max_rss()
+    ENABLED = True
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    _stack.clear()
+    if MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _max_rss()->int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def report()->dict:
+    "Return the stages recorded since enable()."
+    return {
+        "total_time": None if _start is None else time.perf_counter() - _start,
+        "process_max_rss_kb": _max_rss(),
+        "max_rss_growth_kb": _max_rss() - _rss,
+        "stages": {name: dict(record) for name, record in _stages.items()},
+    }
+
+def write_report(filename, data=None):
+    with open(filename, "w") as f:
+        json.dump(report() if data is None else data, f, indent=2)
+
+
+def summarize(reports)->dict:
+    "Combine the reports of several runs, e.g. the GMs of a batch."
+    stages = {}
+    for rep in reports:
+        for name, record in rep["stages"].items():
+            total = stages.setdefault(name, {"calls": 0, "time": 0.0,
+                                             "max_time": 0.0, "runs": 0})
+            total["calls"] += record["calls"]
+            total["time"]  += record["time"]
+            if "peak_bytes" in record:
+                total["peak_bytes"] = max(total.get("peak_bytes", 0), record["peak_bytes"])
+            total["max_time"] = max(total["max_time"], record["time"])
+            total["runs"] += 1
+    for total in stages.values():
+        total["mean_time"] = total["time"] / total["runs"]
+    return {
+        "runs": len(reports),
+        "total_time": sum(rep["total_time"] or 0.0 for rep in reports),
+        # largest peak of any process that ran the reports (e.g. pool workers)
+        "process_max_rss_kb": max((rep["process_max_rss_kb"] for rep in reports), default=0),
+        "max_rss_growth_kb": max((rep["max_rss_growth_kb"] for rep in reports), default=0),
+        "stages": stages,
+    }
+
+
+class profile:
+    "Enable profiling for the duration of a with block; the result is in .report()."
+    def __init__(self, memory=False):
+        self.memory = memory
+
+    def __enter__(self):
+        enable(self.memory)
+        return self
+
+    def __exit__(self, *exc):
+        self._report = report()
+        disable()
+        return False
+
+    def report(self)->dict:
+        return self._report if hasattr(self, "_report") else report()
+
+
+if __name__ == "__main__":
+    # Summarize the JSON reports given as arguments
+    reports = []
+    for filename in sys.argv[1:]:
+        with open(filename) as f:
+            reports.append(json.load(f))
+    json.dump(summarize(reports), sys.stdout, indent=2)
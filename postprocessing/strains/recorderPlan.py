@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Print the smallest set of section deformation recorders needed to
+evaluate damage states with fiberStrains.py.
+
+    python recorderPlan.py modelDetails.json [options] > recorders.tcl
+
+Options
+-ele <elems>        elements, e.g. 3020,4010 or "all" (default 4010)
+-dsr <dsrs>         damage state regions, e.g. dsr1,dsr3 or "7ds" (default 7ds)
+-dT <float>         record every dT of analysis time instead of every step
+-binary             binary output (eleDef<sec>.bin) instead of xml (eleDef<sec>.txt)
+-headers <dir>      with -binary, directory for the xml header of every
+                    recorder (default .), to be copied next to its output
+-steps <int>        number of analysis steps of a GM
+-dt <float>         analysis time step, with
+-duration <float>   the duration of a GM, in place of -steps
+-json <file>        also write the plan, with the columns of every recorder
+
+Damage is evaluated from eps, kappaZ and kappaY at one integration point
+of each element (see fiberStrains.damage_section), so one recorder is
+printed per integration point, for all elements evaluated there whose
+damage state regions contain at least one fiber. The expected size of
+the recorder output of one GM is printed to stderr when the number of
+steps is known.
+"""
+import os
+import sys
+import json
+import math
+
+from fiberRecorders import damage_states, elem_section, fiber_index
+import fiberStrains as fs
+
+# Deformation label of each section dof, as in the headers of xml recorders
+DOF_RESPONSES = {"P": "eps", "Mz": "kappaZ", "My": "kappaY", "T": "theta", "Vy": "gammaY", "Vz": "gammaZ"}
+# Approximate bytes per value of xml output at the default precision (e.g. "-1.23456e-05 ")
+TEXT_WIDTH = 13
+
+def section_responses(model, ele, i)->list:
+    "Responses of the section deformation recorder at integration point i of element ele."
+    el = model["elements"][str(int(ele))]
+    s = model["sections"][el["sections"][i]]
+    base = model["sections"][s["section"]] if "section" in s else s
+    dofs = ["P", "Mz", "My"] + (["T"] if "torsion" in base else [])
+    dofs += [dof for dof in s.get("dof", ()) if dof not in dofs]
+    return [DOF_RESPONSES[dof] for dof in dofs]
+
+
+def plan_recorders(model, elems, dsrs, fmt="xml")->list:
+    """
+    Return one recorder per integration point, with the elements whose
+    damage state regions (any of dsrs) contain fibers at that point.
+    """
+    regions = [damage_states(d) for d in fs.DIAMETERS]
+    recorders = {}
+    for ele in elems:
+        sec = fs.damage_section(ele)
+        s = elem_section(model, ele, int(sec) - 1)
+        states = fs.element_regions(ele, regions)
+        if s is None or not any(len(fiber_index(model, s, states[ds])) for ds in dsrs):
+            continue
+        responses = section_responses(model, ele, int(sec) - 1)
+        rec = recorders.setdefault(sec, {
+            "file": f"eleDef{sec}" + (".bin" if fmt == "binary" else ".txt"),
+            "format": fmt,
+            "section": sec,
+            "elements": [],
+            "responses": responses
+        })
+        if responses != rec["responses"]:
+            raise ValueError(f"Element {ele} records different responses than {rec['elements'][0]}")
+        if int(ele) not in rec["elements"]:
+            rec["elements"].append(int(ele))
+    return list(recorders.values())
+
+
+def recorder_command(rec, dT=None)->str:
+    return f"recorder Element -{rec['format']} {rec['file']} -time " \
+         + (f"-dT {dT} " if dT else "") \
+         + "-ele " + " ".join(map(str, rec["elements"])) \
+         + f" section {rec['section']} deformation;"
+
+
+def write_header(rec, filename):
+    """
+    Write an xml header with the columns of binary recorder `rec`, which
+    xmlutils.read_sect_bin uses to read its output.
+    """
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n <OpenSees>\n')
+        f.write("    <TimeOutput>\n        <ResponseType>time</ResponseType>\n    </TimeOutput>\n")
+        for ele in rec["elements"]:
+            f.write(f'    <ElementOutput eleTag="{ele}">\n'
+                    f'        <GaussPointOutput number="{rec["section"]}">\n'
+                    f'            <SectionOutput>\n')
+            for r in rec["responses"]:
+                f.write(f"                <ResponseType>{r}</ResponseType>\n")
+            f.write("            </SectionOutput>\n        </GaussPointOutput>\n    </ElementOutput>\n")
+        f.write(" </OpenSees>\n")
+
+
+def recorder_bytes(rec, nrows)->int:
+    "Expected size of the data of a recorder with nrows rows (headers are not counted)."
+    ncols = 1 + len(rec["elements"])*len(rec["responses"])
+    if rec["format"] == "binary":
+        # doubles and a newline per row
+        return nrows*(8*ncols + 1)
+    return nrows*ncols*TEXT_WIDTH
+
+
+def parse_args(args)->dict:
+    opts = {
+        "model": None,
+        "elems": [4010],
+        "dsr": list(fs.DSRS),
+        "dT": None,
+        "format": "xml",
+        "steps": None,
+        "dt": None,
+        "duration": None,
+        "json": None,
+        "headers": "."
+    }
+    argi = iter(args)
+    for arg in argi:
+        if arg in ["-h", "--help"]:
+            print(__doc__)
+            sys.exit()
+        elif arg == "-ele":
+            opts["elems"] = [ele if ele == "all" else int(ele) for ele in next(argi).split(",")]
+        elif arg == "-dsr":
+            opts["dsr"] = next(argi).split(",")
+        elif arg == "-dT":
+            opts["dT"] = float(next(argi))
+        elif arg == "-binary":
+            opts["format"] = "binary"
+        elif arg == "-steps":
+            opts["steps"] = int(next(argi))
+        elif arg == "-dt":
+            opts["dt"] = float(next(argi))
+        elif arg == "-duration":
+            opts["duration"] = float(next(argi))
+        elif arg == "-json":
+            opts["json"] = next(argi)
+        elif arg == "-headers":
+            opts["headers"] = next(argi)
+        else:
+            opts["model"] = arg
+
+    if opts["elems"] == ["all"]:
+        opts["elems"] = list(fs.COLUMNS)
+    if opts["dsr"] == ["7ds"]:
+        opts["dsr"] = list(fs.DSRS)
+    return opts
+
+
+if __name__ == "__main__":
+    opts = parse_args(sys.argv[1:])
+    if opts["model"] is None:
+        print(__doc__)
+        sys.exit(1)
+
+    model = fs.read_model(opts["model"], elements=opts["elems"])
+    recorders = plan_recorders(model, opts["elems"], opts["dsr"], opts["format"])
+    for rec in recorders:
+        print(recorder_command(rec, opts["dT"]))
+        if opts["format"] == "binary":
+            os.makedirs(opts["headers"], exist_ok=True)
+            write_header(rec, os.path.join(opts["headers"], os.path.splitext(rec["file"])[0] + ".xml"))
+
+    # rows recorded per GM
+    duration = opts["duration"]
+    if duration is None and opts["steps"] is not None and opts["dt"] is not None:
+        duration = opts["steps"]*opts["dt"]
+    if opts["dT"] and duration is not None:
+        nrows = math.floor(duration/opts["dT"]) + 1
+    elif opts["steps"] is not None:
+        nrows = opts["steps"]
+    elif duration is not None and opts["dt"] is not None:
+        nrows = round(duration/opts["dt"])
+    else:
+        nrows = None
+
+    if nrows is not None:
+        for rec in recorders:
+            rec["bytes"] = recorder_bytes(rec, nrows)
+            print(f"{rec['file']}: {len(rec['elements'])} elements, "
+                  f"{rec['bytes']/1e6:.1f} MB", file=sys.stderr)
+        print(f"{nrows} rows, {sum(rec['bytes'] for rec in recorders)/1e6:.1f} MB per GM",
+              file=sys.stderr)
+
+    if opts["json"] is not None:
+        with open(opts["json"], "w") as f:
+            json.dump({"dT": opts["dT"], "rows": nrows, "recorders": recorders}, f, indent=2)
@@ -0,0 +1,134 @@
+"""
+Tests of fiberStrains.py, run on the sample recorders in SectionRegions/EQresponse.
+
+    python -m pytest postprocessing/strains
+"""
+import os
+import sys
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+SAMPLE = HERE.parents[1]/"SectionRegions"/"EQresponse"
+sys.path[:0] = [str(HERE), str(SAMPLE.parent)]
+
+import fiberStrains as fs
+
+
+def copy_gm(root, name)->Path:
+    "Copy the sample GM into root/name."
+    gm = Path(root)/name
+    gm.mkdir()
+    for file in ("modelDetails.json", "eleDef1.txt", "eleDef4.txt"):
+        shutil.copy(SAMPLE/file, gm/file)
+    return gm
+
+
+def write_binary(filename, data):
+    "Write data like an OpenSees -binary recorder: the doubles of each row, then a newline."
+    rows = np.empty(len(data), dtype=[("data", np.float64, (data.shape[1],)), ("end", "S1")])
+    rows["data"] = data
+    rows["end"] = b"\n"
+    rows.tofile(filename)
+
+
+def test_batch_reports_truncated_recorder(tmp_path):
+    copy_gm(tmp_path, "GM1")
+    gm2 = copy_gm(tmp_path, "GM2")
+    with open(gm2/"eleDef1.txt", "r+b") as f:
+        f.truncate(200_000)
+
+    results = fs.batch_DS(str(tmp_path/"GM*"), [4010, 2010], jobs=1, cache=False)
+
+    assert results[str(tmp_path/"GM1")]["error"] is None
+    assert "truncated" in results[str(tmp_path/"GM2")]["error"]
+    assert (tmp_path/"GM1"/"DamageStatesByElement.csv").exists()
+    assert not (gm2/"DamageStatesByElement.csv").exists()
+
+
+def test_fiber_manifest_round_trip(tmp_path, monkeypatch):
+    import fiberRecorders as fr
+    model = fs.read_model(str(SAMPLE/"modelDetails.json"), compiled=False)
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("out")
+    options = {"record_file": "out/fib.txt", "format": "binary", "logging": 0, "Dcol": 84.0}
+    states = fr.damage_states(84.0)
+    recorders = [
+        fr.print_section(model, 4010, s, fr.elem_section(model, 4010, s-1), fr.base_cmd, options, states)
+        for s in (1, 4)
+    ]
+    fr.write_manifest("out/fib.json", recorders, options)
+
+    rng = np.random.default_rng(0)
+    written = {}
+    for rec in recorders:
+        data = rng.random((20, rec["columns"]))
+        data[:, 0] = np.arange(20)
+        write_binary(rec["file"], data)
+        written[rec["section"]] = data
+
+    # a region that the manifest lists, whichever fibers the regions select
+    with open("out/fib.json") as f:
+        manifest = json.load(f)
+    listed = [f for rec in manifest["recorders"] for f in rec["fibers"] if f["regions"]]
+    assert listed
+    region = listed[0]["regions"][0]
+
+    fibers, time, values = fr.read_manifest_fibers("out/fib.json", elements=[4010], region=region)
+    assert len(fibers) == values.shape[0] == sum(region in f["regions"] for f in listed)
+    assert np.array_equal(time, np.arange(20))
+    for f, v in zip(fibers, values):
+        assert region in f["regions"]
+        assert np.array_equal(v, written[f["section"]][:, f["strain"]])
+
+
+# Output of "recorder Element -binary def.bin -time -ele 1 section 1 deformation"
+# for four steps of a 2D fiber section column, written by OpenSees
+OPENSEES_BINARY = bytes.fromhex(
+    "000000000000d03f84bd1566382ae4be2aa9aff0b6a423bf0a"
+    "000000000000e03f86bd1566382af4be2ca9aff0b6a433bf0a"
+    "000000000000e83f429c2099543ffebebe7d076912773dbf0a"
+    "000000000000f03f83bd1566382a04bf2aa9aff0b6a443bf0a"
+)
+OPENSEES_TEXT = [
+    [0.25, -9.61538e-06, -0.000149867],
+    [0.5,  -1.92308e-05, -0.000299735],
+    [0.75, -2.88462e-05, -0.000449602],
+    [1.0,  -3.84615e-05, -0.000599469],
+]
+
+def test_read_opensees_binary(tmp_path):
+    import xmlutils
+    (tmp_path/"def.bin").write_bytes(OPENSEES_BINARY)
+    keys = [("time",), ("1", "1", "eps"), ("1", "1", "kappaZ")]
+    table = xmlutils.read_sect_bin(tmp_path/"def.bin", header=keys)
+    assert np.allclose(table.data, OPENSEES_TEXT, rtol=1e-5)
+    assert np.allclose(table["1"]["1"]["kappaZ"], np.array(OPENSEES_TEXT)[:, 2], rtol=1e-5)
+
+    window = xmlutils.read_sect_bin(tmp_path/"def.bin", header=keys, t0=0.5, t1=0.75, time=True)
+    assert np.array_equal(window["time"], [0.5, 0.75])
+
+
+def test_first_exceedance_ignores_nan_fibers():
+    eps = np.array([
+        [0.0, np.nan, np.nan, np.nan],
+        [0.0, 0.001,  0.003,  -0.02],
+        [0.0, -0.006, 0.0,    0.0],
+    ])
+    first, fibers = fs.first_exceedance(eps, [0.002, -0.005, -0.011, 0.0])
+    assert first.tolist() == [2, 1, 3, -1]
+    assert [f.tolist() for f in fibers] == [[1], [2], [1], []]
+
+
+def test_read_rejects_negative_rows_and_zero_stride(tmp_path):
+    import pytest, xmlutils
+    shutil.copy(SAMPLE/"eleDef4.txt", tmp_path/"eleDef4.txt")
+    for kwds in (dict(t0=-10), dict(t1=-1), dict(stride=0)):
+        for cache in (False, True):
+            with pytest.raises(ValueError):
+                xmlutils.read_sect_xml4(tmp_path/"eleDef4.txt", cache=cache, **kwds)
+    rows = xmlutils.read_sect_xml4(tmp_path/"eleDef4.txt", cache=False).nsteps
+    assert xmlutils.read_sect_xml4(tmp_path/"eleDef4.txt", t0=rows-10).nsteps == 10